@@ -3,8 +3,14 @@ Debug the actual response structure
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import json
 
+# Shared session so repeated requests reuse the keep-alive connection
+_session = requests.Session()
+_session.headers.update({"Content-Type": "application/json"})
+_session.mount("http://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
+
 def debug_response():
     print("🔍 Debugging Response Structure...")
     
@@ -14,10 +20,9 @@ def debug_response():
     }
     
     try:
-        response = requests.post(
+        response = _session.post(
             "http://localhost:5000/api/chat",
-            json=chat_data,
-            headers={"Content-Type": "application/json"}
+            json=chat_data
         )
         
         print(f"Status Code: {response.status_code}")
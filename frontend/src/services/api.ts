@@ -2,12 +2,25 @@ import axios, { AxiosInstance, AxiosResponse } from 'axios'
 import { 
   ChatRequest, 
   ChatResponse, 
+  ChatResponsePayload,
+  CompactSourceData,
+  SourceData,
   HealthCheckResponse, 
   ApiInfoResponse, 
   FeedbackRequest,
   ErrorResponse 
 } from '../types/api'
 
+// Expand compact {id, score, meta} sources into the shape the UI renders
+const expandSources = (sources: CompactSourceData[]): SourceData[] =>
+  sources.map((source) => ({
+    id: `source_${source.id}`,
+    title: `Source ${source.id + 1}`,
+    content: `Relevant information from source ${source.id + 1}`,
+    relevanceScore: source.score,
+    metadata: source.meta,
+  }))
+
 class ApiService {
   private api: AxiosInstance
 
@@ -79,10 +92,13 @@ class ApiService {
         headers['X-User-API-Key'] = userApiKey
       }
       
-      const response: AxiosResponse<ChatResponse> = await this.api.post('/chat', request, {
+      const response: AxiosResponse<ChatResponsePayload> = await this.api.post('/chat', request, {
         headers
       })
-      return response.data
+      return {
+        ...response.data,
+        sources: expandSources(response.data.sources || []),
+      }
     } catch (error: any) {
       console.error('Chat request failed:', error)
       
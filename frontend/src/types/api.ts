@@ -12,6 +12,7 @@ export interface ChatResponse {
   response: string
   timestamp: string
   sources: SourceData[]
+  sources_count?: number
   topScore: number
   sessionId?: string
   metadata?: {
@@ -22,6 +23,11 @@ export interface ChatResponse {
   }
 }
 
+// Wire format of /api/chat: sources are sent compactly and expanded client-side
+export interface ChatResponsePayload extends Omit<ChatResponse, 'sources'> {
+  sources: CompactSourceData[]
+}
+
 export interface StreamingResponse {
   type: 'content' | 'sources' | 'done' | 'error'
   data: any
@@ -41,6 +47,12 @@ export interface SourceData {
   }
 }
 
+export interface CompactSourceData {
+  id: number
+  score: number
+  meta: SourceData['metadata']
+}
+
 export interface HealthCheckResponse {
   status: 'healthy' | 'unhealthy'
   timestamp: string
@@ -0,0 +1,22 @@
+"""
+Gunicorn configuration for the health chatbot backend.
+
+Run from the repository root with:
+    gunicorn -c gunicorn_conf.py --chdir src enhanced_web_chatbot:app
+
+Each worker process loads its own embedding model and FAISS index, so lower
+WEB_CONCURRENCY on memory-constrained hosts. Threads within a worker overlap
+Groq network waits, which release the GIL.
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = 8
+keepalive = 30
+
+# Streaming responses stay open for the whole generation
+timeout = 120
@@ -6,20 +6,153 @@ for progress monitoring and recovery.
 """
 
 import pickle
+import math
+import re
 import numpy as np
 import faiss
+import pyarrow as pa
+import pyarrow.parquet as pq
 from sentence_transformers import SentenceTransformer
-from typing import List, Tuple, Dict, Any
+from sentence_transformers.util import batch_to_device
+from typing import List, Tuple, Dict, Any, Optional
 import logging
 import time
 import os
 from tqdm import tqdm
 import shutil
+import tempfile
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from chunking import iter_chunk_batches, count_chunks
+from embedding_models import save_encoder_info
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# FAISS index factory presets for embedding storage, from most to least compressed.
+# Embeddings are unit-normalized and indexed by inner product (cosine similarity).
+INDEX_PRESETS = {
+    "ivfpq": "OPQ32_128,IVF4096_HNSW32,PQ32x8",  # 32 B/vector, for million-chunk corpora
+    "ivfpq4fs": "IVF4096,PQ32x4fs",               # 16 B/vector, SIMD fast-scan lookup tables
+    "ivfsq8": "IVF1024,SQ8",                      # int8, 384 B/vector, <1% recall loss
+    "sq8": "SQ8",                                 # int8 brute-force scan
+    "hnswsqfp16": "HNSW32,SQfp16",                # FP16 graph index, near-lossless
+    "sqfp16": "SQfp16",                           # FP16 brute-force scan, 768 B/vector
+    "flat": "Flat",                               # uncompressed FP32
+}
+
+# FAISS warns below ~39 training points per k-means centroid
+MIN_POINTS_PER_CENTROID = 39
+# PQ codebooks with 8-bit codes have 256 centroids per sub-quantizer
+MIN_PQ_TRAIN = 256 * MIN_POINTS_PER_CENTROID
+
+
+def fit_index_factory(index_factory: str, num_vectors: int) -> str:
+    """
+    Scale an index factory string down to what a corpus can train.
+    
+    The IVF list count is capped so every coarse centroid gets enough training
+    points, and PQ indexes fall back to Flat when there are too few vectors to
+    train their codebooks (a brute-force scan is fast at that size anyway).
+    
+    Args:
+        index_factory: FAISS index factory string
+        num_vectors: Number of vectors the index will be trained on
+        
+    Returns:
+        Index factory string suitable for num_vectors
+    """
+    if "PQ" in index_factory and num_vectors < MIN_PQ_TRAIN:
+        logger.warning(f"Only {num_vectors:,} vectors, too few to train {index_factory}; using Flat")
+        return "Flat"
+    
+    max_lists = max(1, num_vectors // MIN_POINTS_PER_CENTROID)
+    
+    def _cap(match):
+        nlist = int(match.group(1))
+        if nlist > max_lists:
+            logger.warning(f"Reducing IVF lists from {nlist} to {max_lists} for {num_vectors:,} vectors")
+            nlist = max_lists
+        return f"IVF{nlist}"
+    
+    return re.sub(r"IVF(\d+)", _cap, index_factory)
+
+# Columnar (structure-of-arrays) layout for chunk metadata, one row per vector.
+# Dictionary encoding stores each distinct source path once. Other metadata
+# keys are carried as extra columns with inferred types.
+METADATA_SCHEMA = pa.schema([
+    ("source", pa.dictionary(pa.int32(), pa.string())),
+    ("file_type", pa.dictionary(pa.int32(), pa.string())),
+    ("row", pa.int32()),
+    ("page", pa.int32()),
+    ("chunk_index", pa.int32()),
+    ("total_chunks", pa.int32()),
+    ("chunk_size", pa.int32()),
+    ("original_doc_index", pa.int32()),
+])
+
+
+def build_metadata_table(metadata: List[Dict]) -> pa.Table:
+    """
+    Convert a batch of chunk metadata dicts into a columnar Arrow table.
+    
+    Args:
+        metadata: Chunk metadata dicts
+        
+    Returns:
+        Arrow table with the METADATA_SCHEMA columns, followed by one column per
+        other key (stored as strings if its values have mixed types)
+    """
+    columns = {
+        field.name: pa.array([m.get(field.name) for m in metadata], type=field.type)
+        for field in METADATA_SCHEMA
+    }
+    extra_keys = dict.fromkeys(key for m in metadata for key in m if key not in columns)
+    for key in extra_keys:
+        values = [m.get(key) for m in metadata]
+        try:
+            columns[key] = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            columns[key] = pa.array([None if value is None else str(value) for value in values],
+                                    type=pa.string())
+    return pa.table(columns)
+
+
+def concat_metadata(tables: List[pa.Table]) -> pa.Table:
+    """Concatenate metadata tables, null-filling extra columns missing from some of them."""
+    return pa.concat_tables(tables, promote_options="default")
+
+
+def write_index(index: faiss.Index, index_path: str, level: int = 3):
+    """
+    Write a FAISS index, streaming it through zstd when the path ends in ".zst".
+    
+    Args:
+        index: FAISS index to write
+        index_path: Output path
+        level: zstd compression level
+    """
+    if not index_path.endswith(".zst"):
+        faiss.write_index(index, index_path)
+        return
+    
+    if not ZSTD_AVAILABLE:
+        raise ImportError("zstandard is required to write a .zst index. Install with: pip install zstandard")
+    with open(index_path, 'wb') as f:
+        with zstandard.ZstdCompressor(level=level).stream_writer(f) as compressed:
+            writer = faiss.PyCallbackIOWriter(compressed.write)
+            faiss.write_index(index, writer)
+            del writer  # Flush before the zstd frame is closed
+
 
 class BatchEmbeddingProcessor:
     """
@@ -27,7 +160,10 @@ class BatchEmbeddingProcessor:
     """
     
     def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
-                 batch_size: int = 128, chunk_batch_size: int = 50000):
+                 batch_size: int = 128, chunk_batch_size: int = 50000,
+                 index_factory: str = "ivfpq",
+                 max_train: int = 256000, nprobe: int = 32,
+                 backend: str = "onnx", gpu_train: bool = True):
         """
         Initialize the batch processor.
         
@@ -35,90 +171,268 @@ class BatchEmbeddingProcessor:
             model_name: Sentence transformer model name
             batch_size: Batch size for embedding generation
             chunk_batch_size: Number of chunks to process in each batch
+            index_factory: Name of an INDEX_PRESETS entry or a raw FAISS index factory
+                string (e.g. "HNSW32" for a pure in-memory graph index)
+            max_train: Maximum number of vectors used to train the index
+            nprobe: IVF lists scanned per query; stored in the saved index
+            backend: SentenceTransformer inference backend ("onnx" or "torch")
+            gpu_train: Run IVF coarse-quantizer k-means on a GPU when faiss-gpu sees one;
+                encoding, add and search stay on the CPU either way
         """
         self.model_name = model_name
         self.batch_size = batch_size
         self.chunk_batch_size = chunk_batch_size
+        self.index_factory = INDEX_PRESETS.get(index_factory, index_factory)
+        self.max_train = max_train
+        self.train_size = max_train
+        self.nprobe = nprobe
+        self.backend = backend
+        self.gpu_train = gpu_train
         self.model = None
+        self.pool = None
         self.faiss_index = None
-        self.metadata = []
+        self.pending_embeddings = []
+        self.metadata = METADATA_SCHEMA.empty_table()
         self.embedding_dim = None
         
-        # Force CPU usage
-        os.environ["CUDA_VISIBLE_DEVICES"] = ""
+        # Force CPU usage, unless GPUs are kept visible for index training
+        if not gpu_train:
+            os.environ["CUDA_VISIBLE_DEVICES"] = ""
+        
+        # Cap FAISS OpenMP threads to avoid thread-explosion memory spikes
+        omp_threads = os.environ.get("OMP_NUM_THREADS")
+        if omp_threads:
+            faiss.omp_set_num_threads(int(omp_threads))
         
     def load_model(self):
         """Load the sentence transformer model."""
         if self.model is None:
-            logger.info(f"Loading model: {self.model_name}")
-            self.model = SentenceTransformer(self.model_name, device='cpu')
+            logger.info(f"Loading model: {self.model_name} (backend: {self.backend})")
+            try:
+                self.model = SentenceTransformer(
+                    self.model_name,
+                    device='cpu',
+                    backend=self.backend,
+                    model_kwargs={"provider": "CPUExecutionProvider"} if self.backend == "onnx" else None
+                )
+            except Exception as e:
+                # ONNX export needs optimum[onnxruntime]; fall back to eager PyTorch
+                logger.warning(f"Failed to load {self.backend} backend, falling back to torch: {e}")
+                self.backend = "torch"
+                self.model = SentenceTransformer(self.model_name, device='cpu')
             
             # Optimize for CPU
             import torch
             torch.set_num_threads(4)
             
+            # One torch encoder process per ~4 threads; MiniLM intra-op scaling flattens beyond that.
+            # ONNX Runtime already spreads one session over every core, so it runs in-process.
+            num_workers = (os.cpu_count() or 4) // 4
+            if self.backend == "torch" and num_workers > 1:
+                # Spawned workers size their torch thread pools from OMP_NUM_THREADS at import
+                omp_threads = os.environ.get("OMP_NUM_THREADS")
+                os.environ["OMP_NUM_THREADS"] = "4"
+                try:
+                    self.pool = self.model.start_multi_process_pool(['cpu'] * num_workers)
+                finally:
+                    if omp_threads is None:
+                        del os.environ["OMP_NUM_THREADS"]
+                    else:
+                        os.environ["OMP_NUM_THREADS"] = omp_threads
+                logger.info(f"Started multi-process encode pool with {num_workers} workers x 4 threads")
+            
             self.embedding_dim = self.model.get_sentence_embedding_dimension()
+            if not self.model.tokenizer.is_fast:
+                logger.warning("Model tokenizer is not a fast (Rust) tokenizer; pre-tokenization will be slow")
+            
             logger.info(f"Model loaded. Embedding dimension: {self.embedding_dim}")
     
-    def process_batch(self, chunked_docs: List, batch_num: int, total_batches: int) -> Tuple[np.ndarray, List]:
+    def stop_pool(self):
+        """Shut down the multi-process encode pool, if running."""
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+    
+    def prepare_batch(self, texts: List[str]) -> Tuple[np.ndarray, Optional[List[Dict]]]:
+        """
+        Length-sort a batch and pre-tokenize it into padded mini-batches.
+        
+        Runs on the loader thread so the Rust fast tokenizer works ahead of the
+        encoder. Sorting by length keeps padding within each mini-batch small.
+        
+        Args:
+            texts: Chunk texts
+            
+        Returns:
+            Tuple of (sort order, tokenized mini-batches); the mini-batches are None
+            when the multi-process pool is used, since its workers tokenize themselves
+        """
+        order = np.argsort([len(text) for text in texts], kind='stable')
+        if self.pool is not None:
+            return order, None
+        
+        sorted_texts = [texts[i] for i in order]
+        features = [
+            self.model.tokenize(sorted_texts[i:i + self.batch_size])
+            for i in range(0, len(sorted_texts), self.batch_size)
+        ]
+        return order, features
+    
+    def _encode_features(self, features: List[Dict]) -> np.ndarray:
+        """Run the model forward pass over pre-tokenized mini-batches."""
+        import torch
+        
+        embeddings = []
+        with torch.inference_mode():
+            for batch_features in tqdm(features, desc="Encoding"):
+                batch_features = batch_to_device(batch_features, self.model.device)
+                output = self.model(batch_features)['sentence_embedding']
+                output = torch.nn.functional.normalize(output, p=2, dim=1)
+                embeddings.append(output.float().cpu().numpy())
+        return np.concatenate(embeddings)
+    
+    def process_batch(self, texts: List[str], metadata: pa.Table, batch_num: int,
+                      total_batches: int, prepared: Optional[Tuple] = None) -> Tuple[np.ndarray, pa.Table]:
         """
         Process a batch of chunks.
         
         Args:
-            chunked_docs: List of chunked documents
+            texts: Chunk texts
+            metadata: Chunk metadata table, parallel to texts
             batch_num: Current batch number
             total_batches: Total number of batches
+            prepared: Output of prepare_batch, if already computed
             
         Returns:
             Tuple of (embeddings, metadata)
         """
         logger.info(f"Processing batch {batch_num}/{total_batches}")
         
-        # Extract texts and metadata
-        texts = [doc.page_content for doc in chunked_docs]
-        metadata = [doc.metadata for doc in chunked_docs]
+        if prepared is None:
+            prepared = self.prepare_batch(texts)
+        order, features = prepared
         
         # Generate embeddings
         start_time = time.time()
-        embeddings = self.model.encode(
-            texts,
-            batch_size=self.batch_size,
-            show_progress_bar=True,
-            convert_to_numpy=True
-        )
+        if self.pool is not None:
+            sorted_texts = [texts[i] for i in order]
+            chunk_size = min(math.ceil(len(texts) / len(self.pool['processes']) / 10), 5000)
+            embeddings = self.model.encode_multi_process(
+                sorted_texts,
+                self.pool,
+                batch_size=self.batch_size,
+                chunk_size=chunk_size,
+                normalize_embeddings=True
+            )
+        else:
+            embeddings = self._encode_features(features)
         end_time = time.time()
         
+        # Restore the original chunk order
+        embeddings = embeddings[np.argsort(order)]
+        
         processing_time = end_time - start_time
         logger.info(f"Batch {batch_num} processed in {processing_time:.2f} seconds")
-        logger.info(f"Processing speed: {len(chunked_docs)/processing_time:.2f} chunks/second")
+        logger.info(f"Processing speed: {len(texts)/processing_time:.2f} chunks/second")
         
         return embeddings, metadata
     
     def create_faiss_index(self, embedding_dim: int):
         """Create a new FAISS index."""
-        logger.info("Creating new FAISS index")
-        self.faiss_index = faiss.IndexFlatL2(embedding_dim)
+        logger.info(f"Creating new FAISS index: {self.index_factory}")
+        self.faiss_index = faiss.index_factory(embedding_dim, self.index_factory, faiss.METRIC_INNER_PRODUCT)
         self.embedding_dim = embedding_dim
     
+    def train_index(self, sample_embeddings: np.ndarray):
+        """
+        Train the FAISS index (coarse quantizer, OPQ rotation and PQ codebooks).
+        
+        Args:
+            sample_embeddings: Embeddings to train on, subsampled to max_train rows
+        """
+        if len(sample_embeddings) > self.max_train:
+            rng = np.random.default_rng(1234)
+            sample_idx = rng.choice(len(sample_embeddings), self.max_train, replace=False)
+            sample_embeddings = sample_embeddings[sample_idx]
+        
+        # Run the IVF k-means assignment step on the GPU; the trained index stays on the CPU
+        ivf_index = faiss.try_extract_index_ivf(self.faiss_index)
+        use_gpu = self.gpu_train and ivf_index is not None and faiss.get_num_gpus() > 0
+        if use_gpu:
+            gpu_resources = faiss.StandardGpuResources()
+            gpu_resources.setTempMemory(512 * 1024 * 1024)  # Cap scratch memory to avoid OOM
+            # The SWIG setter holds no Python reference: keep the GPU index (and its
+            # resources) bound to locals until the pointer is reset below
+            clustering_index = faiss.index_cpu_to_gpu(gpu_resources, 0, faiss.IndexFlatL2(ivf_index.d))
+            ivf_index.clustering_index = clustering_index
+        
+        logger.info(f"Training FAISS index on {len(sample_embeddings):,} vectors{' (GPU k-means)' if use_gpu else ''}")
+        start_time = time.time()
+        try:
+            self.faiss_index.train(np.ascontiguousarray(sample_embeddings, dtype=np.float32))
+        finally:
+            if use_gpu:
+                ivf_index.clustering_index = None
+                del clustering_index, gpu_resources
+        logger.info(f"Index trained in {time.time() - start_time:.2f} seconds")
+        
+        if ivf_index is not None:
+            faiss.ParameterSpace().set_index_parameter(self.faiss_index, "nprobe", self.nprobe)
+    
     def add_to_index(self, embeddings: np.ndarray):
-        """Add embeddings to the FAISS index."""
+        """
+        Add embeddings to the FAISS index.
+        
+        Indexes that need training buffer their input until train_size vectors
+        have arrived, then train on the whole sample and add it.
+        """
         if self.faiss_index is None:
             self.create_faiss_index(embeddings.shape[1])
         
-        self.faiss_index.add(embeddings.astype('float32'))
+        if not self.faiss_index.is_trained:
+            self.pending_embeddings.append(embeddings)
+            num_pending = sum(len(pending) for pending in self.pending_embeddings)
+            if num_pending < self.train_size:
+                logger.info(f"Holding {num_pending:,}/{self.train_size:,} vectors for index training")
+                return
+            self.flush_pending()
+            return
+        
+        # No-op when the embeddings are already C-contiguous float32, as encode returns them
+        self.faiss_index.add(np.ascontiguousarray(embeddings, dtype=np.float32))
         logger.info(f"Added {len(embeddings)} vectors to index. Total: {self.faiss_index.ntotal}")
     
-    def save_checkpoint(self, checkpoint_path: str = "checkpoint"):
-        """Save current progress as checkpoint."""
+    def flush_pending(self):
+        """Train the index on the held-back vectors (even if fewer than train_size) and add them."""
+        if not self.pending_embeddings:
+            return
+        embeddings = np.concatenate(self.pending_embeddings)
+        self.pending_embeddings = []
+        if not self.faiss_index.is_trained:
+            self.train_index(embeddings)
+        self.add_to_index(embeddings)
+    
+    def save_checkpoint(self, embeddings: np.ndarray, metadata: pa.Table, batch_num: int,
+                        checkpoint_path: str = "checkpoint"):
+        """
+        Save a batch as an append-only checkpoint shard.
+        
+        Only the current batch is written, so total checkpoint I/O stays linear in
+        the number of batches instead of rewriting the growing index every time.
+        
+        Args:
+            embeddings: Embeddings of the batch
+            metadata: Metadata of the batch
+            batch_num: Zero-based batch number, used as the shard number
+            checkpoint_path: Checkpoint directory
+        """
         if not os.path.exists(checkpoint_path):
             os.makedirs(checkpoint_path)
         
-        # Save FAISS index
-        faiss.write_index(self.faiss_index, os.path.join(checkpoint_path, "vector_index.idx"))
-        
-        # Save metadata
-        with open(os.path.join(checkpoint_path, "vector_metadata.pkl"), 'wb') as f:
-            pickle.dump(self.metadata, f)
+        # Save batch embeddings, then metadata; a shard counts once both exist
+        shard_prefix = os.path.join(checkpoint_path, f"shard_{batch_num:05d}")
+        np.save(shard_prefix + ".npy", embeddings)
+        pq.write_table(metadata, shard_prefix + ".meta.parquet")
         
         # Save processing state
         state = {
@@ -131,38 +445,66 @@ class BatchEmbeddingProcessor:
         with open(os.path.join(checkpoint_path, "processing_state.pkl"), 'wb') as f:
             pickle.dump(state, f)
         
-        logger.info(f"Checkpoint saved to {checkpoint_path}")
+        logger.info(f"Checkpoint shard {batch_num} saved to {checkpoint_path}")
     
     def load_checkpoint(self, checkpoint_path: str = "checkpoint"):
-        """Load progress from checkpoint."""
+        """
+        Load progress from checkpoint shards, rebuilding the index from them.
+        
+        Must run after load_model: the checkpoint is only reused when its
+        processing state matches the loaded model name and embedding dimension.
+        """
         if not os.path.exists(checkpoint_path):
             logger.info("No checkpoint found, starting fresh")
             return False
         
+        # Shards from a different model cannot be mixed with new embeddings
+        state_path = os.path.join(checkpoint_path, "processing_state.pkl")
+        if os.path.exists(state_path):
+            with open(state_path, 'rb') as f:
+                state = pickle.load(f)
+            if (state.get("model_name"), state.get("embedding_dim")) != (self.model_name, self.embedding_dim):
+                logger.warning(f"Checkpoint was written by {state.get('model_name')} "
+                               f"(dim {state.get('embedding_dim')}), not {self.model_name} "
+                               f"(dim {self.embedding_dim}); discarding it and starting fresh")
+                shutil.rmtree(checkpoint_path)
+                return False
+        
         try:
-            # Load FAISS index
-            self.faiss_index = faiss.read_index(os.path.join(checkpoint_path, "vector_index.idx"))
+            batch_num = 0
+            while True:
+                shard_prefix = os.path.join(checkpoint_path, f"shard_{batch_num:05d}")
+                if not (os.path.exists(shard_prefix + ".npy") and os.path.exists(shard_prefix + ".meta.parquet")):
+                    break
+                
+                # Re-add shard embeddings (the first shard also retrains the index).
+                # Memory-mapped, so shard pages are faulted in only while being added.
+                self.add_to_index(np.load(shard_prefix + ".npy", mmap_mode='r'))
+                shard_metadata = pq.read_table(shard_prefix + ".meta.parquet")
+                self.metadata = concat_metadata([self.metadata, shard_metadata])
+                batch_num += 1
             
-            # Load metadata
-            with open(os.path.join(checkpoint_path, "vector_metadata.pkl"), 'rb') as f:
-                self.metadata = pickle.load(f)
+            if batch_num == 0:
+                logger.info("Checkpoint directory has no complete shards, starting fresh")
+                return False
             
-            # Load state
-            with open(os.path.join(checkpoint_path, "processing_state.pkl"), 'rb') as f:
-                state = pickle.load(f)
-            
-            logger.info(f"Checkpoint loaded. Processed chunks: {len(self.metadata)}")
-            logger.info(f"Index vectors: {self.faiss_index.ntotal}")
+            logger.info(f"Checkpoint loaded from {batch_num} shards. Processed chunks: {len(self.metadata)}")
+            logger.info(f"Index vectors: {self.faiss_index.ntotal} "
+                        f"(+{sum(len(pending) for pending in self.pending_embeddings):,} held for training)")
             
             return True
             
         except Exception as e:
             logger.error(f"Error loading checkpoint: {e}")
+            self.faiss_index = None
+            self.pending_embeddings = []
+            self.metadata = METADATA_SCHEMA.empty_table()
             return False
     
-    def process_all_batches(self, chunked_docs_path: str = "chunked_documents.pkl",
+    def process_all_batches(self, chunked_docs_path: str = "chunked_documents.parquet",
                            checkpoint_path: str = "checkpoint",
-                           resume: bool = True):
+                           resume: bool = True,
+                           index_path: str = "vector_index.idx"):
         """
         Process all chunks in batches.
         
@@ -170,15 +512,17 @@ class BatchEmbeddingProcessor:
             chunked_docs_path: Path to chunked documents
             checkpoint_path: Path to save checkpoints
             resume: Whether to resume from checkpoint
+            index_path: Path to save the final FAISS index (".zst" to compress)
         """
-        # Load chunked documents
-        logger.info(f"Loading chunked documents from {chunked_docs_path}")
-        with open(chunked_docs_path, 'rb') as f:
-            chunked_docs = pickle.load(f)
-        
-        total_chunks = len(chunked_docs)
+        # Chunks are streamed batch by batch; only the row count is read up front
+        logger.info(f"Streaming chunked documents from {chunked_docs_path}")
+        total_chunks = count_chunks(chunked_docs_path)
         logger.info(f"Total chunks to process: {total_chunks:,}")
         
+        # Train on a sample drawn from across batches, sized to the corpus
+        self.train_size = min(self.max_train, total_chunks)
+        self.index_factory = fit_index_factory(self.index_factory, self.train_size)
+        
         # Calculate batches
         total_batches = (total_chunks + self.chunk_batch_size - 1) // self.chunk_batch_size
         logger.info(f"Processing in {total_batches} batches of {self.chunk_batch_size} chunks each")
@@ -192,44 +536,47 @@ class BatchEmbeddingProcessor:
             start_batch = len(self.metadata) // self.chunk_batch_size
             logger.info(f"Resuming from batch {start_batch + 1}")
         
-        # Process batches
+        # Process batches through a load -> embed -> upsert pipeline. Bounded
+        # queues apply backpressure so at most two batches wait per stage.
         start_time = time.time()
-        
-        for batch_num in range(start_batch, total_batches):
-            batch_start = batch_num * self.chunk_batch_size
-            batch_end = min((batch_num + 1) * self.chunk_batch_size, total_chunks)
-            
-            logger.info(f"\n{'='*60}")
-            logger.info(f"Processing batch {batch_num + 1}/{total_batches}")
-            logger.info(f"Chunks {batch_start:,} to {batch_end:,}")
-            logger.info(f"{'='*60}")
-            
-            # Get batch data
-            batch_docs = chunked_docs[batch_start:batch_end]
-            
-            # Process batch
-            embeddings, metadata = self.process_batch(batch_docs, batch_num + 1, total_batches)
-            
-            # Add to index
-            self.add_to_index(embeddings)
-            self.metadata.extend(metadata)
+        stop_event = threading.Event()
+        embed_q = queue.Queue(maxsize=2)
+        upsert_q = queue.Queue(maxsize=2)
+        
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            loader = executor.submit(self._load_stage, chunked_docs_path, start_batch,
+                                     total_batches, embed_q, stop_event)
+            upserter = executor.submit(self._upsert_stage, upsert_q, checkpoint_path,
+                                       total_chunks, start_time, stop_event)
+            try:
+                # Embed stage runs on the main thread; torch releases the GIL
+                while True:
+                    item = self._get(embed_q, stop_event)
+                    if item is None:
+                        break
+                    batch_num, texts, metadata, prepared = item
+                    batch_start = batch_num * self.chunk_batch_size
+                    
+                    logger.info(f"\n{'='*60}")
+                    logger.info(f"Processing batch {batch_num + 1}/{total_batches}")
+                    logger.info(f"Chunks {batch_start:,} to {batch_start + len(texts):,}")
+                    logger.info(f"{'='*60}")
+                    
+                    embeddings, metadata = self.process_batch(texts, metadata, batch_num + 1,
+                                                              total_batches, prepared)
+                    self._put(upsert_q, (batch_num, embeddings, metadata), stop_event)
+                
+                self._put(upsert_q, None, stop_event)
+            except BaseException:
+                stop_event.set()
+                raise
             
-            # Save checkpoint every batch
-            self.save_checkpoint(checkpoint_path)
-            
-            # Calculate progress
-            processed_chunks = len(self.metadata)
-            progress = (processed_chunks / total_chunks) * 100
-            elapsed_time = time.time() - start_time
-            estimated_total_time = (elapsed_time / processed_chunks) * total_chunks
-            remaining_time = estimated_total_time - elapsed_time
-            
-            logger.info(f"Progress: {processed_chunks:,}/{total_chunks:,} ({progress:.1f}%)")
-            logger.info(f"Elapsed time: {elapsed_time/60:.1f} minutes")
-            logger.info(f"Estimated remaining time: {remaining_time/60:.1f} minutes")
+            # Surface errors raised inside the worker stages
+            loader.result()
+            upserter.result()
         
         # Final save
-        self.save_final_results()
+        self.save_final_results(index_path=index_path, checkpoint_path=checkpoint_path)
         
         total_time = time.time() - start_time
         logger.info(f"\n{'='*60}")
@@ -240,23 +587,116 @@ class BatchEmbeddingProcessor:
         logger.info(f"Average speed: {len(self.metadata)/total_time:.2f} chunks/second")
         logger.info(f"Final index size: {self.faiss_index.ntotal:,} vectors")
     
+    @staticmethod
+    def _put(q: queue.Queue, item, stop_event: threading.Event):
+        """Put an item on a pipeline queue, giving up once the pipeline is stopped."""
+        while not stop_event.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+    
+    @staticmethod
+    def _get(q: queue.Queue, stop_event: threading.Event):
+        """Get an item from a pipeline queue; returns None once the pipeline is stopped."""
+        while not stop_event.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return None
+    
+    def _load_stage(self, chunked_docs_path: str, start_batch: int, total_batches: int,
+                    embed_q: queue.Queue, stop_event: threading.Event):
+        """Pipeline stage 1: stream chunk batches from disk, pre-tokenize them and feed the embed stage."""
+        try:
+            batches = iter_chunk_batches(chunked_docs_path, self.chunk_batch_size)
+            for batch_num, (texts, metadata) in enumerate(batches):
+                if stop_event.is_set() or batch_num >= total_batches:
+                    break
+                if batch_num < start_batch:
+                    continue  # Already in the checkpoint
+                prepared = self.prepare_batch(texts)
+                metadata = build_metadata_table(metadata)
+                self._put(embed_q, (batch_num, texts, metadata, prepared), stop_event)
+            self._put(embed_q, None, stop_event)
+        except BaseException:
+            stop_event.set()
+            raise
+    
+    def _upsert_stage(self, upsert_q: queue.Queue, checkpoint_path: str,
+                      total_chunks: int, start_time: float, stop_event: threading.Event):
+        """Pipeline stage 3: add embeddings to the index, extend metadata and checkpoint."""
+        try:
+            while True:
+                item = self._get(upsert_q, stop_event)
+                if item is None:
+                    break
+                batch_num, embeddings, metadata = item
+                
+                # Add to index
+                self.add_to_index(embeddings)
+                self.metadata = concat_metadata([self.metadata, metadata])
+                
+                # Save checkpoint every batch; runs while the next batch is encoding
+                self.save_checkpoint(embeddings, metadata, batch_num, checkpoint_path)
+                
+                # Calculate progress
+                processed_chunks = len(self.metadata)
+                progress = (processed_chunks / total_chunks) * 100
+                elapsed_time = time.time() - start_time
+                estimated_total_time = (elapsed_time / processed_chunks) * total_chunks
+                remaining_time = estimated_total_time - elapsed_time
+                
+                logger.info(f"Progress: {processed_chunks:,}/{total_chunks:,} ({progress:.1f}%)")
+                logger.info(f"Elapsed time: {elapsed_time/60:.1f} minutes")
+                logger.info(f"Estimated remaining time: {remaining_time/60:.1f} minutes")
+            
+            # Corpus smaller than the training sample: train on everything there is
+            if not stop_event.is_set():
+                self.flush_pending()
+        except BaseException:
+            stop_event.set()
+            raise
+    
     def save_final_results(self, index_path: str = "vector_index.idx",
-                          metadata_path: str = "vector_metadata.pkl"):
-        """Save final results."""
+                          metadata_path: str = "vector_metadata.pkl",
+                          checkpoint_path: str = "checkpoint"):
+        """Save final results and remove the checkpoint directory."""
         logger.info("Saving final results...")
         
-        # Save FAISS index
-        faiss.write_index(self.faiss_index, index_path)
+        # Encoding is finished; release the worker processes
+        self.stop_pool()
+        
+        # Save FAISS index (zstd-compressed when index_path ends in .zst)
+        write_index(self.faiss_index, index_path)
+        # Both backends run the FP32 weights, so the RAG system encodes queries with the FP32 model
+        save_encoder_info(index_path, self.model_name, "fp32")
         logger.info(f"FAISS index saved to {index_path}")
         
-        # Save metadata
+        # Save metadata as a list of dicts, the format the RAG system loads
+        records = [
+            {key: value for key, value in row.items() if value is not None}
+            for row in self.metadata.to_pylist()
+        ]
         with open(metadata_path, 'wb') as f:
-            pickle.dump(self.metadata, f)
+            pickle.dump(records, f, protocol=pickle.HIGHEST_PROTOCOL)
         logger.info(f"Metadata saved to {metadata_path}")
         
-        # Clean up checkpoint directory
-        if os.path.exists("checkpoint"):
-            shutil.rmtree("checkpoint")
+        # Clean up checkpoint directory: one rename now, the unlinks in the background.
+        # A fresh trash directory per run, so leftovers from an interrupted cleanup never collide.
+        if os.path.exists(checkpoint_path):
+            checkpoint_path = os.path.abspath(checkpoint_path)
+            try:
+                trash_path = tempfile.mkdtemp(prefix=os.path.basename(checkpoint_path) + ".trash.",
+                                              dir=os.path.dirname(checkpoint_path))
+                os.rename(checkpoint_path, os.path.join(trash_path, "checkpoint"))
+            except OSError as e:
+                logger.warning(f"Could not remove checkpoint directory {checkpoint_path}: {e}")
+                return
+            threading.Thread(target=shutil.rmtree, args=(trash_path,), kwargs={"ignore_errors": True},
+                             name="checkpoint-cleanup").start()
             logger.info("Checkpoint directory cleaned up")
     
     def test_search(self, query: str, k: int = 5):
@@ -268,19 +708,19 @@ class BatchEmbeddingProcessor:
         logger.info(f"Testing search for: '{query}'")
         
         # Generate query embedding
-        query_embedding = self.model.encode([query], convert_to_numpy=True)
+        query_embedding = self.model.encode([query], convert_to_numpy=True, normalize_embeddings=True)
         
         # Search
         start_time = time.time()
-        scores, indices = self.faiss_index.search(query_embedding.astype('float32'), k)
+        scores, indices = self.faiss_index.search(np.ascontiguousarray(query_embedding, dtype=np.float32), k)
         search_time = time.time() - start_time
         
         logger.info(f"Search completed in {search_time:.4f} seconds")
         
         # Display results
         for i, (score, idx) in enumerate(zip(scores[0], indices[0]), 1):
-            if idx < len(self.metadata):
-                metadata = self.metadata[idx]
+            if 0 <= idx < len(self.metadata):
+                metadata = self.metadata.slice(idx, 1).to_pylist()[0]
                 print(f"\nResult {i} (Score: {score:.4f}):")
                 print(f"  Source: {metadata.get('source', 'Unknown')}")
                 print(f"  Chunk: {metadata.get('chunk_index', 'N/A')}/{metadata.get('total_chunks', 'N/A')}")
@@ -291,11 +731,15 @@ def main():
     
     # Configuration
     config = {
-        "chunked_docs_path": "chunked_documents.pkl",
+        "chunked_docs_path": "chunked_documents.parquet",
         "model_name": "sentence-transformers/all-MiniLM-L6-v2",
         "batch_size": 128,
         "chunk_batch_size": 50000,  # Process 50K chunks at a time
+        "index_factory": "ivfpq",  # "ivfsq8" (int8) or "sqfp16" (FP16) trade memory for recall
+        "backend": "onnx",  # ONNX Runtime is ~2-3x faster than eager PyTorch on CPU
+        "gpu_train": True,  # IVF k-means on GPU if faiss-gpu finds one
         "checkpoint_path": "checkpoint",
+        "index_path": "vector_index.idx",  # "vector_index.idx.zst" writes a zstd-compressed index
         "resume": True
     }
     
@@ -306,7 +750,10 @@ def main():
     processor = BatchEmbeddingProcessor(
         model_name=config["model_name"],
         batch_size=config["batch_size"],
-        chunk_batch_size=config["chunk_batch_size"]
+        chunk_batch_size=config["chunk_batch_size"],
+        index_factory=config["index_factory"],
+        backend=config["backend"],
+        gpu_train=config["gpu_train"]
     )
     
     try:
@@ -314,7 +761,8 @@ def main():
         processor.process_all_batches(
             chunked_docs_path=config["chunked_docs_path"],
             checkpoint_path=config["checkpoint_path"],
-            resume=config["resume"]
+            resume=config["resume"],
+            index_path=config["index_path"]
         )
         
         # Test search functionality
@@ -7,64 +7,95 @@ preserving metadata and ensuring logical text boundaries.
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
-from typing import List
+from typing import List, Dict, Iterator, Tuple, Optional
+from functools import lru_cache
 import logging
 import pickle
 import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Rust-backed text splitter (optional)
+try:
+    from semantic_text_splitter import TextSplitter
+    RUST_SPLITTER_AVAILABLE = True
+except ImportError:
+    RUST_SPLITTER_AVAILABLE = False
+
+# Process-parallel chunking (optional)
+try:
+    from joblib import Parallel, delayed
+    JOBLIB_AVAILABLE = True
+except ImportError:
+    JOBLIB_AVAILABLE = False
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def chunk_documents(documents: List[Document], 
-                   chunk_size: int = 2000, 
-                   chunk_overlap: int = 200,
-                   separators: List[str] = None) -> List[Document]:
+# Documents per parallel chunking task; amortizes worker dispatch and pickling
+CHUNKING_TASK_SIZE = 256
+
+# Default separators optimized for health/medical content
+DEFAULT_SEPARATORS = [
+    "\n\n",  # Paragraph breaks
+    "\n",    # Line breaks
+    ". ",    # Sentence endings
+    "! ",    # Exclamation sentences
+    "? ",    # Question sentences
+    "; ",    # Semicolon breaks
+    ", ",    # Comma breaks
+    " ",     # Word breaks
+    ""       # Character breaks (fallback)
+]
+
+
+@lru_cache(maxsize=None)
+def _get_splitter(chunk_size: int, chunk_overlap: int, separators: Optional[Tuple[str, ...]]):
+    """
+    Build (once per process) the split function for the given settings.
+    
+    Uses the Rust semantic-text-splitter when installed and no custom separators
+    are given, LangChain's RecursiveCharacterTextSplitter otherwise.
+    """
+    if RUST_SPLITTER_AVAILABLE and separators is None:
+        return TextSplitter(capacity=chunk_size, overlap=chunk_overlap).chunks
+    
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=list(separators or DEFAULT_SEPARATORS),
+        length_function=len,
+        is_separator_regex=False
+    ).split_text
+
+
+def _split_documents(documents: List[Document], start_index: int, chunk_size: int,
+                     chunk_overlap: int, separators: Optional[Tuple[str, ...]]) -> List[Document]:
     """
-    Split documents into chunks using RecursiveCharacterTextSplitter.
+    Chunk a contiguous slice of documents.
+    
+    Module-level so it can run in joblib worker processes.
     
     Args:
-        documents: List of Document objects to chunk
+        documents: Slice of Document objects to chunk
+        start_index: Index of the first document of the slice in the full list
         chunk_size: Target size for each chunk in characters
         chunk_overlap: Number of characters to overlap between chunks
-        separators: Custom separators for splitting (optional)
+        separators: Custom separators, or None for the defaults
         
     Returns:
         List of chunked Document objects
     """
-    if separators is None:
-        # Default separators optimized for health/medical content
-        separators = [
-            "\n\n",  # Paragraph breaks
-            "\n",    # Line breaks
-            ". ",    # Sentence endings
-            "! ",    # Exclamation sentences
-            "? ",    # Question sentences
-            "; ",    # Semicolon breaks
-            ", ",    # Comma breaks
-            " ",     # Word breaks
-            ""       # Character breaks (fallback)
-        ]
-    
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        separators=separators,
-        length_function=len,
-        is_separator_regex=False
-    )
-    
+    split_text = _get_splitter(chunk_size, chunk_overlap, separators)
     chunked_docs = []
-    total_original_docs = len(documents)
     
-    logger.info(f"Starting chunking process for {total_original_docs} documents...")
-    logger.info(f"Chunk size: {chunk_size} characters, Overlap: {chunk_overlap} characters")
-    
-    for i, doc in enumerate(documents):
+    for i, doc in enumerate(documents, start_index):
         try:
             # Split the document content
-            chunks = splitter.split_text(doc.page_content)
+            chunks = split_text(doc.page_content)
             
             # Create Document objects for each chunk
             for chunk_idx, chunk_text in enumerate(chunks):
@@ -84,13 +115,57 @@ def chunk_documents(documents: List[Document],
                 chunked_docs.append(chunked_doc)
             
             if (i + 1) % 1000 == 0:
-                logger.info(f"Processed {i + 1}/{total_original_docs} documents...")
+                logger.info(f"Processed {i + 1} documents...")
                 
         except Exception as e:
             logger.error(f"Error chunking document {i}: {str(e)}")
             # Add the original document as a single chunk if chunking fails
             chunked_docs.append(doc)
     
+    return chunked_docs
+
+
+def chunk_documents(documents: List[Document], 
+                   chunk_size: int = 1200, 
+                   chunk_overlap: int = 50,
+                   separators: List[str] = None,
+                   n_jobs: int = -1) -> List[Document]:
+    """
+    Split documents into chunks.
+    
+    Uses the Rust semantic-text-splitter when installed, which splits on the same
+    paragraph/line/sentence/word boundaries natively; falls back to LangChain's
+    RecursiveCharacterTextSplitter otherwise or when custom separators are given.
+    Documents are split independently, so with joblib installed they are spread
+    over worker processes in tasks of CHUNKING_TASK_SIZE documents.
+    
+    Args:
+        documents: List of Document objects to chunk
+        chunk_size: Target size for each chunk in characters
+        chunk_overlap: Number of characters to overlap between chunks
+        separators: Custom separators for splitting (optional)
+        n_jobs: Number of worker processes (-1 for all cores, 1 to chunk in-process)
+        
+    Returns:
+        List of chunked Document objects
+    """
+    separators = tuple(separators) if separators is not None else None
+    total_original_docs = len(documents)
+    
+    logger.info(f"Starting chunking process for {total_original_docs} documents...")
+    logger.info(f"Chunk size: {chunk_size} characters, Overlap: {chunk_overlap} characters")
+    
+    if not JOBLIB_AVAILABLE or n_jobs == 1 or total_original_docs <= CHUNKING_TASK_SIZE:
+        chunked_docs = _split_documents(documents, 0, chunk_size, chunk_overlap, separators)
+    else:
+        results = Parallel(n_jobs=n_jobs, backend='loky')(
+            delayed(_split_documents)(
+                documents[start:start + CHUNKING_TASK_SIZE], start, chunk_size, chunk_overlap, separators
+            )
+            for start in range(0, total_original_docs, CHUNKING_TASK_SIZE)
+        )
+        chunked_docs = [chunk for task_chunks in results for chunk in task_chunks]
+    
     logger.info(f"Chunking complete! Created {len(chunked_docs)} chunks from {total_original_docs} documents")
     return chunked_docs
 
@@ -132,60 +207,158 @@ def analyze_chunk_statistics(chunked_docs: List[Document]) -> dict:
     Returns:
         Dictionary with chunk statistics
     """
-    chunk_sizes = [len(chunk.page_content) for chunk in chunked_docs]
+    # Build one frame in a single pass, then aggregate with vectorized groupbys
+    df = pd.DataFrame({
+        'size': [len(chunk.page_content) for chunk in chunked_docs],
+        'source': [chunk.metadata.get('source', 'unknown') for chunk in chunked_docs],
+        'orig': [chunk.metadata.get('original_doc_index', -1) for chunk in chunked_docs]
+    })
     
     stats = {
-        'total_chunks': len(chunked_docs),
-        'avg_chunk_size': sum(chunk_sizes) / len(chunk_sizes),
-        'min_chunk_size': min(chunk_sizes),
-        'max_chunk_size': max(chunk_sizes),
-        'chunks_by_source': {},
-        'chunks_per_doc': {}
-    }
-    
-    # Analyze chunks by source
-    for chunk in chunked_docs:
-        source = chunk.metadata.get('source', 'unknown')
-        stats['chunks_by_source'][source] = stats['chunks_by_source'].get(source, 0) + 1
-        
+        'total_chunks': len(df),
+        'avg_chunk_size': float(df['size'].mean()),
+        'min_chunk_size': int(df['size'].min()),
+        'max_chunk_size': int(df['size'].max()),
+        'chunks_by_source': df.groupby('source', sort=False).size().to_dict(),
         # Track chunks per original document
-        orig_doc_idx = chunk.metadata.get('original_doc_index', 'unknown')
-        if orig_doc_idx != 'unknown':
-            stats['chunks_per_doc'][orig_doc_idx] = stats['chunks_per_doc'].get(orig_doc_idx, 0) + 1
+        'chunks_per_doc': df[df['orig'] >= 0].groupby('orig', sort=False).size().to_dict()
+    }
     
     return stats
 
 
 def save_chunked_documents(chunked_docs: List[Document], 
-                          output_file: str = "chunked_documents.pkl") -> None:
+                          output_file: str = "chunked_documents.parquet") -> None:
     """
     Save chunked documents to disk for later use.
     
+    Parquet output (the default) can be streamed back one batch at a time with
+    iter_chunk_batches; a .pkl path keeps the legacy pickle format.
+    
     Args:
         chunked_docs: List of chunked Document objects
-        output_file: Output file path
+        output_file: Output file path (.parquet or .pkl)
     """
     try:
-        with open(output_file, 'wb') as f:
-            pickle.dump(chunked_docs, f)
+        if output_file.endswith(".pkl"):
+            with open(output_file, 'wb') as f:
+                pickle.dump(chunked_docs, f)
+        else:
+            table = pa.Table.from_pydict({
+                'page_content': pa.array([doc.page_content for doc in chunked_docs], type=pa.large_string()),
+                'metadata': _metadata_array([doc.metadata for doc in chunked_docs])
+            })
+            pq.write_table(table, output_file)
         logger.info(f"Saved {len(chunked_docs)} chunked documents to {output_file}")
     except Exception as e:
         logger.error(f"Failed to save chunked documents: {str(e)}")
+        raise
 
 
-def load_chunked_documents(input_file: str = "chunked_documents.pkl") -> List[Document]:
+def _metadata_array(metadata: List[Dict]) -> pa.Array:
+    """
+    Build the Parquet metadata column from per-chunk metadata dicts.
+    
+    An Arrow struct field has a single type, so keys whose values differ in
+    type across files (e.g. a numeric "row" in one source and a string in
+    another) are stored as strings.
+    """
+    try:
+        return pa.array(metadata)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+    
+    key_types = {}
+    for m in metadata:
+        for key, value in m.items():
+            if value is not None:
+                key_types.setdefault(key, set()).add(type(value))
+    mixed = {key for key, types in key_types.items() if len(types) > 1}
+    logger.warning(f"Storing mixed-type metadata fields as strings: {sorted(mixed)}")
+    return pa.array([
+        {key: str(value) if key in mixed and value is not None else value for key, value in m.items()}
+        for m in metadata
+    ])
+
+
+def _clean_metadata(metadata: Dict) -> Dict:
+    """Drop the null fields Parquet adds for keys missing from a chunk's metadata."""
+    return {key: value for key, value in metadata.items() if value is not None}
+
+
+def count_chunks(input_file: str = "chunked_documents.parquet") -> int:
+    """
+    Count chunked documents without loading them (Parquet reads only the footer).
+    
+    Args:
+        input_file: Input file path (.parquet or .pkl)
+        
+    Returns:
+        Number of chunked documents
+    """
+    if input_file.endswith(".pkl"):
+        with open(input_file, 'rb') as f:
+            return len(pickle.load(f))
+    return pq.ParquetFile(input_file).metadata.num_rows
+
+
+def iter_chunk_batches(input_file: str = "chunked_documents.parquet",
+                       batch_size: int = 50000) -> Iterator[Tuple[List[str], List[Dict]]]:
+    """
+    Stream chunked documents from disk one batch at a time.
+    
+    Yields (texts, metadata) lists directly, without building Document objects.
+    
+    Args:
+        input_file: Input file path (.parquet or .pkl)
+        batch_size: Number of chunks per batch
+        
+    Yields:
+        Tuple of (texts, metadata) for each batch
+    """
+    if input_file.endswith(".pkl"):
+        # Legacy pickle files cannot be streamed; slice the loaded list instead
+        with open(input_file, 'rb') as f:
+            chunked_docs = pickle.load(f)
+        for batch_start in range(0, len(chunked_docs), batch_size):
+            batch_docs = chunked_docs[batch_start:batch_start + batch_size]
+            yield [doc.page_content for doc in batch_docs], [doc.metadata for doc in batch_docs]
+        return
+    
+    # Record batches never span row groups, so re-slice them into exact batch_size
+    # batches to keep batch numbering stable for checkpoint resume
+    parquet_file = pq.ParquetFile(input_file)
+    texts, metadata = [], []
+    for record_batch in parquet_file.iter_batches(batch_size=batch_size):
+        texts.extend(record_batch.column('page_content').to_pylist())
+        metadata.extend(_clean_metadata(m) for m in record_batch.column('metadata').to_pylist())
+        while len(texts) >= batch_size:
+            yield texts[:batch_size], metadata[:batch_size]
+            texts, metadata = texts[batch_size:], metadata[batch_size:]
+    if texts:
+        yield texts, metadata
+
+
+def load_chunked_documents(input_file: str = "chunked_documents.parquet") -> List[Document]:
     """
     Load chunked documents from disk.
     
     Args:
-        input_file: Input file path
+        input_file: Input file path (.parquet or .pkl)
         
     Returns:
         List of chunked Document objects
     """
     try:
-        with open(input_file, 'rb') as f:
-            chunked_docs = pickle.load(f)
+        if input_file.endswith(".pkl"):
+            with open(input_file, 'rb') as f:
+                chunked_docs = pickle.load(f)
+        else:
+            chunked_docs = [
+                Document(page_content=text, metadata=metadata)
+                for texts, metadatas in iter_chunk_batches(input_file)
+                for text, metadata in zip(texts, metadatas)
+            ]
         logger.info(f"Loaded {len(chunked_docs)} chunked documents from {input_file}")
         return chunked_docs
     except Exception as e:
@@ -194,8 +367,8 @@ def load_chunked_documents(input_file: str = "chunked_documents.pkl") -> List[Do
 
 
 def optimize_chunking_parameters(documents: List[Document], 
-                                test_sizes: List[int] = [1000, 1500, 2000, 2500],
-                                test_overlaps: List[int] = [100, 150, 200, 250]) -> dict:
+                                test_sizes: List[int] = [800, 1000, 1200, 1500],
+                                test_overlaps: List[int] = [0, 50, 100, 200]) -> dict:
     """
     Test different chunking parameters to find optimal settings.
     
@@ -259,8 +432,8 @@ def main():
     logger.info("Starting document chunking...")
     chunked_docs = chunk_documents(
         documents, 
-        chunk_size=2000,  # ~500-1000 tokens
-        chunk_overlap=200  # ~50-100 tokens
+        chunk_size=1200,  # ~256 tokens, fits the MiniLM window without truncation
+        chunk_overlap=50  # ~10 tokens
     )
     
     # Inspect chunks
@@ -5,120 +5,394 @@ This module converts mixed-format health data (CSV, PDF, TXT, JSON, HTML)
 into a uniform list of LangChain documents with clear content and metadata.
 """
 
-from langchain_community.document_loaders import (
-    CSVLoader, TextLoader, JSONLoader, PyPDFLoader, UnstructuredHTMLLoader
-)
+from langchain_community.document_loaders import JSONLoader
+import hashlib
+import io
+import itertools
 import os
 import logging
-from typing import List
+import logging.handlers
+import multiprocessing
+import pickle
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 from langchain.schema import Document
+from pypdf import PdfReader
+from tqdm import tqdm
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+    SELECTOLAX_AVAILABLE = True
+except ImportError:
+    SELECTOLAX_AVAILABLE = False
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# Parsed PDF pages are cached here, keyed by file content; set PDF_CACHE_DIR="" to disable
+PDF_CACHE_DIR = os.environ.get("PDF_CACHE_DIR", os.path.join("data", "cache", "pdf"))
+
+# Processes that split a large PDF's pages between them (each re-reads the
+# cross-reference table); 1 keeps extraction in the calling process
+PDF_PAGE_WORKERS = int(os.environ.get("PDF_PAGE_WORKERS", 1))
+PDF_PAGES_PER_TASK = 32
+
+# Set HTML_PARTITION=1 to parse HTML with unstructured's element partitioning
+HTML_PARTITION = os.environ.get("HTML_PARTITION", "") not in ("", "0")
+
+# Elements that end a line of extracted HTML text; table cells are space-separated
+HTML_BLOCK_TAGS = "p, div, li, br, tr, h1, h2, h3, h4, h5, h6, section, article, blockquote, pre, dt, dd"
+
+
+def _read_file(fpath: str) -> bytes:
+    """Read a whole file into memory."""
+    with open(fpath, 'rb') as f:
+        return f.read()
+
+
+def _load_csv(fpath: str, raw_bytes: bytes) -> List[Document]:
+    """Parse a CSV into one document per row."""
+    fname = os.path.basename(fpath)
+    # Latin-1 maps every byte, so it always decodes what UTF-8 rejects
+    encodings = ['utf-8', 'latin-1']
+    
+    for encoding in encodings:
+        try:
+            # Multi-threaded C++ parse; every column is read as raw text
+            read_options = pacsv.ReadOptions(encoding=encoding, use_threads=True)
+            # Quoted cells may span lines (the csv module accepted them too)
+            parse_options = pacsv.ParseOptions(newlines_in_values=True)
+            column_names = pacsv.open_csv(
+                pa.BufferReader(raw_bytes), read_options=read_options, parse_options=parse_options
+            ).schema.names
+            table = pacsv.read_csv(
+                pa.BufferReader(raw_bytes),
+                read_options=read_options,
+                parse_options=parse_options,
+                convert_options=pacsv.ConvertOptions(
+                    column_types={name: pa.string() for name in column_names},
+                    strings_can_be_null=True
+                )
+            )
+        except pa.ArrowInvalid as e:
+            # Only invalid UTF-8 is worth retrying with another encoding
+            if "UTF8" not in str(e):
+                raise
+            continue
+        
+        # Build "col: val" lines column by column with vectorized string kernels;
+        # missing cells become "" and drop out of the row text
+        lines = [
+            pc.fill_null(pc.binary_join_element_wise(f"{col}: ", table.column(i), "\n", ""), "")
+            for i, col in enumerate(table.column_names)
+        ]
+        if lines:
+            contents = pc.utf8_slice_codeunits(pc.binary_join_element_wise(*lines, ""), 0, -1)  # Drop the trailing newline
+        else:
+            contents = pa.array([""] * table.num_rows)
+        docs = [
+            Document(
+                page_content=content,
+                metadata={"source": fpath, "row": idx, "file_type": "csv"}
+            )
+            for idx, content in enumerate(contents.to_pylist())
+        ]
+        logger.debug("Successfully loaded %s with %s encoding", fname, encoding)
+        return docs
+    
+    raise Exception("Could not decode file with any supported encoding")
+
+
+def _load_txt(fpath: str, raw_bytes: bytes) -> List[Document]:
+    """Load a UTF-8 text file as a single document."""
+    return [Document(page_content=raw_bytes.decode('utf-8'), metadata={"source": fpath})]
+
+
+def _load_json(fpath: str, raw_bytes: bytes) -> List[Document]:
+    """Load a JSON file (JSONLoader reads from the path)."""
+    return JSONLoader(fpath).load()
+
+
+def _extract_pdf_pages(raw_bytes: bytes, start: int, stop: int) -> List[str]:
+    """Extract the text of pages [start, stop) of a PDF."""
+    reader = PdfReader(io.BytesIO(raw_bytes))
+    return [reader.pages[page_num].extract_text() for page_num in range(start, stop)]
+
+
+def _pdf_documents(fpath: str, pages: List[str]) -> List[Document]:
+    """One document per page with text; blank (e.g. scanned) pages are skipped."""
+    return [Document(page_content=text, metadata={"source": fpath, "page": page_num})
+            for page_num, text in enumerate(pages) if text and text.strip()]
+
+
+def _load_pdf(fpath: str, raw_bytes: bytes) -> List[Document]:
+    """
+    Parse a PDF into one document per page.
+    
+    Re-ingesting an unchanged PDF skips pypdf entirely: the pages are pickled to
+    PDF_CACHE_DIR under a hash of the file contents and reused on the next run.
+    With PDF_PAGE_WORKERS > 1, large PDFs are split into page ranges extracted
+    by separate processes (pypdf is pure Python and its reader is not
+    thread-safe, so threads would not help).
+    """
+    cache_path = None
+    if PDF_CACHE_DIR:
+        digest = hashlib.blake2b(raw_bytes, digest_size=16).hexdigest()
+        cache_path = os.path.join(PDF_CACHE_DIR, f"{digest}.pkl")
+        try:
+            with open(cache_path, 'rb') as f:
+                pages = pickle.load(f)
+            return _pdf_documents(fpath, pages)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable PDF cache entry {cache_path}: {str(e)}")
+    
+    reader = PdfReader(io.BytesIO(raw_bytes))
+    num_pages = len(reader.pages)
+    if PDF_PAGE_WORKERS > 1 and num_pages > PDF_PAGES_PER_TASK:
+        ranges = [(start, min(start + PDF_PAGES_PER_TASK, num_pages))
+                  for start in range(0, num_pages, PDF_PAGES_PER_TASK)]
+        with ProcessPoolExecutor(max_workers=min(PDF_PAGE_WORKERS, len(ranges))) as executor:
+            futures = [executor.submit(_extract_pdf_pages, raw_bytes, start, stop) for start, stop in ranges]
+            pages = [text for future in futures for text in future.result()]
+    else:
+        pages = [page.extract_text() for page in reader.pages]
+    
+    if cache_path is not None:
+        try:
+            os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+            # Write then rename so parallel workers never see a partial entry
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(pages, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Could not cache parsed PDF {fpath}: {str(e)}")
+    
+    return _pdf_documents(fpath, pages)
+
+
+def _load_html(fpath: str, raw_bytes: bytes) -> List[Document]:
+    """
+    Extract the text of an HTML page as a single document.
+    
+    Uses selectolax's lexbor C parser for plain text extraction; unstructured's much
+    slower partitioning is used when HTML_PARTITION is set or selectolax is
+    not installed.
+    """
+    if HTML_PARTITION or not SELECTOLAX_AVAILABLE:
+        from unstructured.partition.html import partition_html
+        elements = partition_html(text=raw_bytes.decode('utf-8'))
+        text = "\n\n".join(str(element) for element in elements)
+    else:
+        tree = LexborHTMLParser(raw_bytes)
+        # Scripts and styles are not page text
+        tree.strip_tags(["script", "style", "noscript"])
+        for node in tree.css(HTML_BLOCK_TAGS):
+            node.insert_after("\n")
+        for node in tree.css("td, th"):
+            node.insert_after(" ")
+        raw_text = tree.body.text(separator="") if tree.body is not None else ""
+        # One line per block, with runs of whitespace collapsed
+        text = "\n".join(" ".join(line.split()) for line in raw_text.splitlines() if line.strip())
+    return [Document(page_content=text, metadata={"source": fpath})]
+
+
+# Parser per file suffix (lower-case)
+LOADERS = {
+    ".csv": _load_csv,
+    ".txt": _load_txt,
+    ".json": _load_json,
+    ".pdf": _load_pdf,
+    ".html": _load_html,
+}
+
+
+def _file_suffix(fname: str) -> str:
+    """Lower-case file extension used to look up LOADERS."""
+    return os.path.splitext(fname)[1].lower()
+
+
+def load_single_document(fpath: str, raw_bytes: Optional[bytes] = None) -> Optional[List[Document]]:
+    """
+    Parse one data file into LangChain documents.
+    
+    Module-level so it can run in worker processes. Parsing works on the in-memory
+    file contents, so the worker does no disk I/O of its own (except for JSON,
+    whose jq-based loader only reads from a path).
+    
+    Args:
+        fpath: Path to a CSV, TXT, JSON, PDF or HTML file
+        raw_bytes: File contents, read from fpath if not given
+        
+    Returns:
+        List of Document objects (empty for an unsupported or empty file), or
+        None if the file could not be loaded
+    """
+    fname = os.path.basename(fpath)
+    suffix = _file_suffix(fname)
+    loader = LOADERS.get(suffix)
+    if loader is None:
+        logger.debug("Skipping unsupported file: %s", fname)
+        return []
+    
+    try:
+        if raw_bytes is None:
+            raw_bytes = _read_file(fpath)
+        logger.debug("Loading %s: %s", suffix[1:].upper(), fname)
+        return loader(fpath, raw_bytes)
+    except Exception as e:
+        logger.error(f"Failed to load {fname}: {str(e)}")
+        return None
+
+
+def _init_worker_logging(log_queue: multiprocessing.Queue):
+    """Parser process initializer: hand log records to the parent's listener instead of writing them."""
+    logging.getLogger().handlers = [logging.handlers.QueueHandler(log_queue)]
+
+
+def _reader_stage(paths: queue.Queue, buffers: queue.Queue, stop: threading.Event):
+    """I/O stage: read queued files into memory and hand them to the parse stage."""
+    while not stop.is_set():
+        try:
+            file_idx, fpath = paths.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            raw_bytes = _read_file(fpath)
+        except Exception as e:
+            logger.error(f"Failed to read {fpath}: {str(e)}")
+            raw_bytes = None
+        # Waits while the parsers are behind, bounding the bytes held in memory,
+        # but gives up once the pipeline is stopped
+        while not stop.is_set():
+            try:
+                buffers.put((file_idx, fpath, raw_bytes), timeout=0.5)
+                break
+            except queue.Full:
+                continue
+
+
 def load_documents(data_dirs: List[str]) -> List[Document]:
     """
     Load documents from multiple directories with different file formats.
     
+    Runs as a two-stage pipeline: reader threads load file bytes into a bounded
+    queue while worker processes parse them. Set INGEST_WORKERS to override the
+    number of parser processes (defaults to one less than the number of CPUs)
+    and INGEST_IO_THREADS for the number of reader threads.
+    
     Args:
         data_dirs: List of directory paths containing data files
         
     Returns:
-        List of LangChain Document objects
+        List of LangChain Document objects, in directory listing order
     """
-    documents = []
-    total_files_processed = 0
-    total_files_failed = 0
+    all_files = []
     
     for data_dir in data_dirs:
         if not os.path.exists(data_dir):
             logger.warning(f"Directory {data_dir} does not exist, skipping...")
             continue
-            
-        logger.info(f"Processing directory: {data_dir}")
         
-        for fname in os.listdir(data_dir):
-            fpath = os.path.join(data_dir, fname)
-            
-            # Skip directories
-            if os.path.isdir(fpath):
+        num_files = len(all_files)
+        num_skipped = 0
+        with os.scandir(data_dir) as entries:
+            for entry in entries:
+                # Skip directories
+                if not entry.is_file():
+                    continue
+                if _file_suffix(entry.name) not in LOADERS:
+                    logger.debug("Skipping unsupported file: %s", entry.name)
+                    num_skipped += 1
+                    continue
+                all_files.append(entry.path)
+        # One summary line per directory; per-file lines are DEBUG
+        logger.info("Processing directory: %s (%d files, %d unsupported skipped)",
+                    data_dir, len(all_files) - num_files, num_skipped)
+    
+    max_workers = int(os.environ.get("INGEST_WORKERS", max(1, (os.cpu_count() or 1) - 1)))
+    io_threads = int(os.environ.get("INGEST_IO_THREADS", 4))
+    logger.info(f"Loading {len(all_files)} files with {io_threads} reader threads "
+                f"and {max_workers} parser processes")
+    
+    paths = queue.Queue()
+    for item in enumerate(all_files):
+        paths.put(item)
+    buffers = queue.Queue(maxsize=2 * max_workers)
+    # Caps files submitted to the parsers but not yet parsed
+    in_flight = threading.Semaphore(2 * max_workers)
+    
+    results = [None] * len(all_files)
+    progress = tqdm(total=len(all_files), desc="Loading files")
+    
+    def _on_parsed(future):
+        in_flight.release()
+        progress.update()
+    
+    # Workers log through a queue; one listener thread here does the actual I/O
+    log_queue = multiprocessing.Queue()
+    log_listener = logging.handlers.QueueListener(log_queue, *logging.getLogger().handlers,
+                                                  respect_handler_level=True)
+    log_listener.start()
+    
+    def _new_executor():
+        return ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker_logging,
+                                   initargs=(log_queue,))
+    
+    stop = threading.Event()
+    executor = _new_executor()
+    readers = ThreadPoolExecutor(max_workers=io_threads)
+    try:
+        for _ in range(io_threads):
+            readers.submit(_reader_stage, paths, buffers, stop)
+        
+        futures = []
+        for _ in range(len(all_files)):
+            file_idx, fpath, raw_bytes = buffers.get()
+            if raw_bytes is None:
+                progress.update()
                 continue
-                
+            in_flight.acquire()
             try:
-                if fname.endswith(".csv"):
-                    logger.info(f"Loading CSV: {fname}")
-                    # Handle large CSV files that might cause memory issues
-                    try:
-                        docs = CSVLoader(fpath).load()
-                        documents.extend(docs)
-                        total_files_processed += 1
-                    except Exception as csv_error:
-                        logger.warning(f"CSVLoader failed for {fname}, trying alternative method: {str(csv_error)}")
-                        # Try loading with pandas as fallback
-                        try:
-                            import pandas as pd
-                            # Try different encodings
-                            encodings = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']
-                            df = None
-                            
-                            for encoding in encodings:
-                                try:
-                                    df = pd.read_csv(fpath, encoding=encoding, low_memory=False)
-                                    logger.info(f"Successfully loaded {fname} with {encoding} encoding")
-                                    break
-                                except UnicodeDecodeError:
-                                    continue
-                            
-                            if df is None:
-                                raise Exception("Could not decode file with any supported encoding")
-                            
-                            # Convert to documents manually
-                            for idx, row in df.iterrows():
-                                content = "\n".join([f"{col}: {val}" for col, val in row.items() if pd.notna(val)])
-                                doc = Document(
-                                    page_content=content,
-                                    metadata={"source": fpath, "row": idx, "file_type": "csv"}
-                                )
-                                documents.append(doc)
-                            total_files_processed += 1
-                            logger.info(f"Successfully loaded {fname} using pandas fallback")
-                        except Exception as pandas_error:
-                            logger.error(f"Both CSVLoader and pandas failed for {fname}: {str(pandas_error)}")
-                            total_files_failed += 1
-                    
-                elif fname.endswith(".txt"):
-                    logger.info(f"Loading TXT: {fname}")
-                    docs = TextLoader(fpath, encoding='utf-8').load()
-                    documents.extend(docs)
-                    total_files_processed += 1
-                    
-                elif fname.endswith(".json"):
-                    logger.info(f"Loading JSON: {fname}")
-                    docs = JSONLoader(fpath).load()
-                    documents.extend(docs)
-                    total_files_processed += 1
-                    
-                elif fname.endswith(".pdf"):
-                    logger.info(f"Loading PDF: {fname}")
-                    docs = PyPDFLoader(fpath).load()
-                    documents.extend(docs)
-                    total_files_processed += 1
-                    
-                elif fname.endswith(".html"):
-                    logger.info(f"Loading HTML: {fname}")
-                    docs = UnstructuredHTMLLoader(fpath).load()
-                    documents.extend(docs)
-                    total_files_processed += 1
-                    
-                else:
-                    logger.info(f"Skipping unsupported file: {fname}")
-                    
+                future = executor.submit(load_single_document, fpath, raw_bytes)
+            except BrokenProcessPool:
+                # A parser process died (e.g. OOM-killed); its in-flight files are
+                # reported as failed below, the remaining files go to a fresh pool
+                logger.error("Parser process pool crashed, restarting it")
+                executor.shutdown(wait=False)
+                executor = _new_executor()
+                future = executor.submit(load_single_document, fpath, raw_bytes)
+            future.add_done_callback(_on_parsed)
+            futures.append((file_idx, fpath, future))
+        
+        for file_idx, fpath, future in futures:
+            try:
+                results[file_idx] = future.result()
             except Exception as e:
-                logger.error(f"Failed to load {fname}: {str(e)}")
-                total_files_failed += 1
-                continue
+                logger.error(f"Failed to load {os.path.basename(fpath)}: {str(e)}")
+    finally:
+        # Unblock the readers so an error here cannot hang on their queue puts
+        stop.set()
+        readers.shutdown(wait=True)
+        executor.shutdown(wait=True)
+        log_listener.stop()
+        progress.close()
+    
+    # None marks a file that could not be read or parsed
+    total_files_failed = results.count(None)
+    total_files_processed = len(results) - total_files_failed
+    # Flatten the per-file lists in one pass instead of growing a list file by file
+    documents = list(itertools.chain.from_iterable(docs for docs in results if docs is not None))
     
     logger.info(f"Data ingestion complete!")
     logger.info(f"Files processed successfully: {total_files_processed}")
@@ -5,16 +5,22 @@ This module generates embeddings for chunked documents and stores them in a FAIS
 for ultra-fast similarity search and retrieval.
 """
 
+import hashlib
 import pickle
+import sqlite3
 import numpy as np
 import faiss
+import pyarrow as pa
 from sentence_transformers import SentenceTransformer
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional
 import logging
 import os
 from tqdm import tqdm
 import time
 
+from chunking import load_chunked_documents
+from embedding_models import load_index_encoder, load_int8_onnx_model, save_encoder_info
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,26 +31,74 @@ class HealthVectorStore:
     A vector store class for health-related document embeddings with FAISS backend.
     """
     
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", low_precision: bool = False,
+                 embedding_cache: Optional[str] = "embedding_cache.db"):
         """
         Initialize the vector store with a sentence transformer model.
         
         Args:
             model_name: Name of the sentence transformer model to use
+            low_precision: Encode with FP16 weights on GPU, or the int8 ONNX model on CPU.
+                The encoder is recorded next to the saved index, and the RAG system
+                encodes queries with the same one
+            embedding_cache: SQLite file caching embeddings by chunk text, so re-runs
+                only encode new or changed chunks; None disables it
         """
         self.model_name = model_name
+        self.low_precision = low_precision
+        self.embedding_cache = embedding_cache
+        self.precision = None
         self.embedder = None
         self.faiss_index = None
+        self.gpu_resources = None
         self.metadata = []
         self.embedding_dim = None
         
+        # Let FAISS scans use every core
+        faiss.omp_set_num_threads(os.cpu_count())
+        
     def load_embedding_model(self):
         """Load the sentence transformer model."""
         logger.info(f"Loading embedding model: {self.model_name}")
-        self.embedder = SentenceTransformer(self.model_name)
+        import torch
+        
+        if self.low_precision and torch.cuda.is_available():
+            # FP16 halves weight/activation bandwidth and runs on tensor cores
+            self.embedder = SentenceTransformer(self.model_name, device='cuda')
+            self.embedder.half()
+            self.precision = "fp16"
+            logger.info("Using FP16 weights on GPU")
+        elif self.low_precision:
+            # Dynamically quantized int8 export (VNNI dot products on modern x86), the
+            # same model the RAG system loads for int8 indexes
+            self.embedder = load_int8_onnx_model(self.model_name)
+            self.precision = self.embedder.encoder_precision
+            logger.info(f"Using {self.precision} CPU model")
+        else:
+            self.embedder = SentenceTransformer(self.model_name)
+            self.precision = "fp32"
         self.embedding_dim = self.embedder.get_sentence_embedding_dimension()
         logger.info(f"Model loaded. Embedding dimension: {self.embedding_dim}")
         
+    @staticmethod
+    def _get_target_devices() -> List[str]:
+        """
+        Devices for multi-process encoding, or an empty list to encode in-process.
+        
+        Uses every GPU when there is more than one, otherwise EMBED_WORKERS CPU
+        workers when that is set above 1.
+        """
+        import torch
+        
+        gpu_count = torch.cuda.device_count()
+        if gpu_count > 1:
+            return [f"cuda:{i}" for i in range(gpu_count)]
+        
+        cpu_workers = int(os.environ.get("EMBED_WORKERS", 1))
+        if cpu_workers > 1:
+            return ["cpu"] * cpu_workers
+        return []
+    
     def generate_embeddings(self, chunked_docs: List, 
                            batch_size: int = 512,
                            show_progress: bool = True) -> np.ndarray:
@@ -57,24 +111,76 @@ class HealthVectorStore:
             show_progress: Whether to show progress bar
             
         Returns:
-            numpy array of embeddings
+            numpy array of L2-normalized float32 embeddings
         """
         if self.embedder is None:
             self.load_embedding_model()
             
         logger.info(f"Generating embeddings for {len(chunked_docs)} chunks...")
         
-        # Extract text content
-        texts = [doc.page_content for doc in chunked_docs]
+        start_time = time.time()
+        num_docs = len(chunked_docs)
+        embeddings = np.empty((num_docs, self.embedding_dim), dtype=np.float32)
+        
+        # Reuse embeddings of chunks encoded by earlier runs; only the rest are encoded
+        cache = None
+        if self.embedding_cache:
+            cache = sqlite3.connect(self.embedding_cache)
+            cache.execute("CREATE TABLE IF NOT EXISTS embeddings (hash BLOB PRIMARY KEY, vector BLOB)")
+            hashes = self._chunk_hashes(chunked_docs)
+            todo = self._read_cached_embeddings(cache, hashes, embeddings)
+            logger.info(f"{num_docs - len(todo)} embeddings loaded from {self.embedding_cache}, "
+                        f"{len(todo)} chunks to encode")
+        else:
+            todo = np.arange(num_docs)
+        
+        # Encode in order of text length so each batch pads to a similar length;
+        # sentence-transformers only sorts within a single encode call
+        order = todo[np.argsort(
+            np.fromiter((len(chunked_docs[i].page_content) for i in todo), dtype=np.int64, count=len(todo)),
+            kind="stable"
+        )]
         
         # Generate embeddings with progress bar
-        start_time = time.time()
-        embeddings = self.embedder.encode(
-            texts, 
-            show_progress_bar=show_progress, 
-            batch_size=batch_size,
-            convert_to_numpy=True
-        )
+        target_devices = self._get_target_devices() if len(order) else []
+        if target_devices:
+            # Data-parallel encoding: one worker process per GPU / CPU worker
+            logger.info(f"Encoding with a multi-process pool on {target_devices}")
+            texts = [chunked_docs[i].page_content for i in order]
+            pool = self.embedder.start_multi_process_pool(target_devices=target_devices)
+            try:
+                embeddings[order] = self.embedder.encode_multi_process(
+                    texts,
+                    pool,
+                    batch_size=batch_size,
+                    chunk_size=max(1, len(texts) // (4 * len(pool['processes']))),
+                    normalize_embeddings=True
+                )
+            finally:
+                self.embedder.stop_multi_process_pool(pool)
+        else:
+            # Encode one batch at a time straight into the preallocated output, so
+            # neither a copy of every text nor per-batch arrays are held at once
+            for start in tqdm(range(0, len(order), batch_size), desc="Batches",
+                              disable=not show_progress):
+                batch_idx = order[start:start + batch_size]
+                batch = [chunked_docs[i].page_content for i in batch_idx]
+                embeddings[batch_idx] = self.embedder.encode(
+                    batch,
+                    show_progress_bar=False,
+                    batch_size=batch_size,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True
+                )
+        
+        if cache is not None:
+            with cache:
+                cache.executemany("INSERT OR IGNORE INTO embeddings (hash, vector) VALUES (?, ?)",
+                                  ((hashes[i], embeddings[i].tobytes()) for i in todo))
+            cache.close()
+        
+        # Unit-length, C-contiguous float32: ready for the FAISS kernels as-is
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
         
         end_time = time.time()
         logger.info(f"Embeddings generated in {end_time - start_time:.2f} seconds")
@@ -82,36 +188,115 @@ class HealthVectorStore:
         
         return embeddings
     
+    def _chunk_hashes(self, chunked_docs: List) -> List[bytes]:
+        """Embedding cache keys: a hash of the encoder identity and each chunk's text."""
+        encoder_hash = hashlib.blake2b(f"{self.model_name}\0{self.precision}\0".encode(), digest_size=16)
+        hashes = []
+        for doc in chunked_docs:
+            chunk_hash = encoder_hash.copy()
+            chunk_hash.update(doc.page_content.encode('utf-8'))
+            hashes.append(chunk_hash.digest())
+        return hashes
+    
+    @staticmethod
+    def _read_cached_embeddings(cache: sqlite3.Connection, hashes: List[bytes],
+                                out: np.ndarray) -> np.ndarray:
+        """
+        Copy cached embeddings into their rows of out.
+        
+        Returns:
+            Indices of the chunks that were not in the cache
+        """
+        rows_by_hash = {}
+        for i, chunk_hash in enumerate(hashes):
+            rows_by_hash.setdefault(chunk_hash, []).append(i)
+        
+        found = np.zeros(len(hashes), dtype=bool)
+        unique_hashes = list(rows_by_hash)
+        for start in range(0, len(unique_hashes), 900):  # Stay under SQLite's bound-parameter limit
+            keys = unique_hashes[start:start + 900]
+            query = f"SELECT hash, vector FROM embeddings WHERE hash IN ({','.join('?' * len(keys))})"
+            for chunk_hash, vector in cache.execute(query, keys):
+                rows = rows_by_hash[chunk_hash]
+                out[rows] = np.frombuffer(vector, dtype=np.float32)
+                found[rows] = True
+        return np.flatnonzero(~found)
+    
     def create_faiss_index(self, embeddings: np.ndarray, 
-                          index_type: str = "flat") -> faiss.Index:
+                          index_type: str = "hnsw") -> faiss.Index:
         """
         Create FAISS index from embeddings.
         
+        All index types score by inner product, which is cosine similarity for the
+        normalized embeddings produced by generate_embeddings.
+        
         Args:
-            embeddings: numpy array of embeddings
-            index_type: Type of FAISS index ("flat" or "ivf")
+            embeddings: numpy array of L2-normalized embeddings
+            index_type: Type of FAISS index ("hnsw", "flat", "ivf", "ivfpq", "sq8" or "hnswsq8")
             
         Returns:
             FAISS index
         """
         logger.info(f"Creating FAISS {index_type} index...")
         
+        # No copy when the embeddings are already C-contiguous float32
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
         embedding_dim = embeddings.shape[1]
         
-        if index_type == "flat":
-            # Simple L2 distance index - good for small to medium datasets
-            index = faiss.IndexFlatL2(embedding_dim)
+        if index_type in ("sq8", "hnswsq8"):
+            # int8 codes, 4x smaller than FP32
+            if index_type == "sq8":
+                index = faiss.IndexScalarQuantizer(
+                    embedding_dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+                )
+            else:
+                index = faiss.IndexHNSWSQ(
+                    embedding_dim, faiss.ScalarQuantizer.QT_8bit, 32, faiss.METRIC_INNER_PRODUCT
+                )
+            index.train(embeddings)
+        elif index_type == "hnsw":
+            # Graph index - logarithmic query time, no training needed
+            index = faiss.IndexHNSWFlat(embedding_dim, 32, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = 200
+            index.hnsw.efSearch = 64  # Saved with the index; raise for recall, lower for speed
+        elif index_type == "flat":
+            # Exact brute-force index - good for small to medium datasets
+            index = faiss.IndexFlatIP(embedding_dim)
         elif index_type == "ivf":
             # Inverted file index - better for large datasets
             nlist = min(100, len(embeddings) // 100)  # Number of clusters
-            quantizer = faiss.IndexFlatL2(embedding_dim)
-            index = faiss.IndexIVFFlat(quantizer, embedding_dim, nlist)
-            index.train(embeddings)
+            quantizer = faiss.IndexFlatIP(embedding_dim)
+            index = faiss.IndexIVFFlat(quantizer, embedding_dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            # k-means only needs a sample, not the whole corpus
+            train_size = min(len(embeddings), 50_000)
+            sample_idx = np.random.default_rng(1234).choice(len(embeddings), train_size, replace=False)
+            index.train(embeddings[sample_idx])
+            index.nprobe = 16  # Clusters scanned per query; saved with the index
+        elif index_type == "ivfpq":
+            # Product-quantized inverted file index for million-chunk corpora:
+            # M one-byte codes per vector instead of 4 bytes per dimension
+            if len(embeddings) < 256 * 39:
+                logger.warning(f"Too few vectors ({len(embeddings)}) to train PQ codebooks; using a flat index")
+                return self.create_faiss_index(embeddings, index_type="flat")
+            nlist = min(4096, len(embeddings) // 39)  # ~39 training points per centroid at least
+            pq_m = max(m for m in range(1, 49) if embedding_dim % m == 0)  # 48 for 384/768-d models
+            quantizer = faiss.IndexFlatIP(embedding_dim)
+            index = faiss.IndexIVFPQ(quantizer, embedding_dim, nlist, pq_m, 8, faiss.METRIC_INNER_PRODUCT)
+            train_size = min(len(embeddings), 64 * max(nlist, 256))
+            sample_idx = np.random.default_rng(1234).choice(len(embeddings), train_size, replace=False)
+            index.train(embeddings[sample_idx])
+            index.nprobe = 32  # Clusters scanned per query; saved with the index
         else:
             raise ValueError(f"Unsupported index type: {index_type}")
         
         # Add embeddings to index
-        index.add(embeddings.astype('float32'))
+        index.add(embeddings)
+        
+        if index_type == "ivfpq" and faiss.get_num_gpus() > 0:
+            # Serve IVF-PQ from the GPU; the resources must outlive the index
+            self.gpu_resources = faiss.StandardGpuResources()
+            index = faiss.index_cpu_to_gpu(self.gpu_resources, 0, index)
+            logger.info("Moved IVF-PQ index to GPU 0")
         
         logger.info(f"FAISS index created with {index.ntotal} vectors")
         self.faiss_index = index
@@ -129,25 +314,42 @@ class HealthVectorStore:
         Returns:
             List of (score, metadata) tuples
         """
+        return self.search_batch([query], k=k)[0]
+    
+    def search_batch(self, queries: List[str], k: int = 5) -> List[List[Tuple[float, Dict]]]:
+        """
+        Search for several queries with one encode call and one FAISS search.
+        
+        Args:
+            queries: Query strings
+            k: Number of results to return per query
+            
+        Returns:
+            One list of (score, metadata) tuples per query
+        """
         if self.faiss_index is None:
             raise ValueError("FAISS index not initialized. Call create_faiss_index first.")
         
         if self.embedder is None:
             self.load_embedding_model()
         
-        # Generate embedding for query
-        query_embedding = self.embedder.encode([query])
+        # Generate query embeddings; normalized, so scores are cosine similarities
+        query_embeddings = self.embedder.encode(
+            queries,
+            batch_size=64,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
         
         # Search in FAISS index
-        scores, indices = self.faiss_index.search(query_embedding.astype('float32'), k)
+        scores, indices = self.faiss_index.search(np.ascontiguousarray(query_embeddings, dtype=np.float32), k)
         
         # Return results with metadata
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx < len(self.metadata):
-                results.append((float(score), self.metadata[idx]))
-        
-        return results
+        return [
+            [(float(score), self._get_metadata(idx))
+             for score, idx in zip(query_scores, query_indices) if 0 <= idx < len(self.metadata)]
+            for query_scores, query_indices in zip(scores, indices)
+        ]
     
     def save_vector_store(self, index_path: str = "vector_index.idx", 
                          metadata_path: str = "vector_metadata.pkl"):
@@ -156,17 +358,35 @@ class HealthVectorStore:
         
         Args:
             index_path: Path to save FAISS index
-            metadata_path: Path to save metadata
+            metadata_path: Path to save metadata; a ".arrow" path writes a columnar
+                Arrow IPC file that load_vector_store can memory-map
         """
         if self.faiss_index is None:
             raise ValueError("No FAISS index to save")
         
         logger.info(f"Saving FAISS index to {index_path}")
-        faiss.write_index(self.faiss_index, index_path)
+        index = self.faiss_index
+        if self.gpu_resources is not None:
+            # GPU indexes cannot be serialized directly
+            index = faiss.index_gpu_to_cpu(index)
+        faiss.write_index(index, index_path)
+        save_encoder_info(index_path, self.model_name, self.precision)
         
         logger.info(f"Saving metadata to {metadata_path}")
-        with open(metadata_path, 'wb') as f:
-            pickle.dump(self.metadata, f)
+        if metadata_path.endswith(".arrow"):
+            if isinstance(self.metadata, pa.Table):
+                table = self.metadata
+            else:
+                # One column per key seen in any chunk (from_pylist only uses the first row's keys)
+                keys = dict.fromkeys(key for metadata in self.metadata for key in metadata)
+                table = pa.table({key: [metadata.get(key) for metadata in self.metadata] for key in keys})
+            with pa.OSFile(metadata_path, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        else:
+            metadata = self.metadata.to_pylist() if isinstance(self.metadata, pa.Table) else self.metadata
+            with open(metadata_path, 'wb') as f:
+                pickle.dump(metadata, f)
         
         logger.info("Vector store saved successfully")
     
@@ -175,19 +395,45 @@ class HealthVectorStore:
         """
         Load the vector store from disk.
         
+        The index's vector storage and Arrow metadata are memory-mapped, so pages
+        are read from the OS page cache on access instead of being copied up front.
+        That covers the flat codes of Flat, SQ and HNSW indexes and the inverted
+        lists of IVF indexes; an HNSW graph itself is still read into memory.
+        
         Args:
             index_path: Path to FAISS index
-            metadata_path: Path to metadata
+            metadata_path: Path to metadata (.pkl or .arrow)
         """
         logger.info(f"Loading FAISS index from {index_path}")
-        self.faiss_index = faiss.read_index(index_path)
+        try:
+            # Maps the flat code storage of Flat / SQ / HNSW indexes
+            self.faiss_index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_MMAP_IFC)
+        except RuntimeError:
+            # IVF inverted lists can only be mapped through the on-disk lists hook
+            self.faiss_index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+        
+        # Queries must be encoded by the model that embedded the index
+        self.embedder = load_index_encoder(index_path, self.model_name)
+        self.precision = self.embedder.encoder_precision
+        self.embedding_dim = self.embedder.get_sentence_embedding_dimension()
         
         logger.info(f"Loading metadata from {metadata_path}")
-        with open(metadata_path, 'rb') as f:
-            self.metadata = pickle.load(f)
+        if metadata_path.endswith(".arrow"):
+            # Zero-copy: the table's buffers point into the mapped file
+            self.metadata = pa.ipc.open_file(pa.memory_map(metadata_path, 'r')).read_all()
+        else:
+            with open(metadata_path, 'rb') as f:
+                self.metadata = pickle.load(f)
         
         logger.info(f"Loaded vector store with {self.faiss_index.ntotal} vectors")
     
+    def _get_metadata(self, idx: int) -> Dict:
+        """Metadata of one vector, from either a list of dicts or an Arrow table."""
+        if isinstance(self.metadata, pa.Table):
+            row = self.metadata.slice(idx, 1).to_pylist()[0]
+            return {key: value for key, value in row.items() if value is not None}
+        return self.metadata[idx]
+    
     def get_stats(self) -> Dict[str, Any]:
         """Get statistics about the vector store."""
         if self.faiss_index is None:
@@ -201,15 +447,15 @@ class HealthVectorStore:
         }
 
 
-def create_vector_store(chunked_docs_path: str = "chunked_documents.pkl",
+def create_vector_store(chunked_docs_path: str = "chunked_documents.parquet",
                        model_name: str = "all-MiniLM-L6-v2",
                        batch_size: int = 512,
-                       index_type: str = "flat") -> HealthVectorStore:
+                       index_type: str = "hnsw") -> HealthVectorStore:
     """
     Create a complete vector store from chunked documents.
     
     Args:
-        chunked_docs_path: Path to chunked documents pickle file
+        chunked_docs_path: Path to chunked documents file (.parquet or .pkl)
         model_name: Sentence transformer model name
         batch_size: Batch size for embedding generation
         index_type: Type of FAISS index
@@ -219,8 +465,7 @@ def create_vector_store(chunked_docs_path: str = "chunked_documents.pkl",
     """
     # Load chunked documents
     logger.info(f"Loading chunked documents from {chunked_docs_path}")
-    with open(chunked_docs_path, 'rb') as f:
-        chunked_docs = pickle.load(f)
+    chunked_docs = load_chunked_documents(chunked_docs_path)
     
     logger.info(f"Loaded {len(chunked_docs)} chunked documents")
     
@@ -264,22 +509,22 @@ def test_vector_search(vector_store: HealthVectorStore,
     print("VECTOR SEARCH TEST RESULTS")
     print(f"{'='*80}")
     
-    for query in test_queries:
+    try:
+        all_results = vector_store.search_batch(test_queries, k=3)
+    except Exception as e:
+        print(f"Error searching: {str(e)}")
+        return
+    
+    for query, results in zip(test_queries, all_results):
         print(f"\nQuery: '{query}'")
         print("-" * 50)
         
-        try:
-            results = vector_store.search(query, k=3)
-            
-            for i, (score, metadata) in enumerate(results, 1):
-                print(f"Result {i} (Score: {score:.4f}):")
-                print(f"  Source: {metadata.get('source', 'Unknown')}")
-                print(f"  Chunk: {metadata.get('chunk_index', 'N/A')}/{metadata.get('total_chunks', 'N/A')}")
-                print(f"  Size: {metadata.get('chunk_size', 'N/A')} chars")
-                print()
-                
-        except Exception as e:
-            print(f"Error searching for '{query}': {str(e)}")
+        for i, (score, metadata) in enumerate(results, 1):
+            print(f"Result {i} (Score: {score:.4f}):")
+            print(f"  Source: {metadata.get('source', 'Unknown')}")
+            print(f"  Chunk: {metadata.get('chunk_index', 'N/A')}/{metadata.get('total_chunks', 'N/A')}")
+            print(f"  Size: {metadata.get('chunk_size', 'N/A')} chars")
+            print()
 
 
 def main():
@@ -287,12 +532,12 @@ def main():
     
     # Configuration
     config = {
-        "chunked_docs_path": "chunked_documents.pkl",
+        "chunked_docs_path": "chunked_documents.parquet",
         "model_name": "all-MiniLM-L6-v2",  # Fast and efficient model
         "batch_size": 512,  # Adjust based on available memory
-        "index_type": "flat",  # Use "ivf" for very large datasets
+        "index_type": "hnsw",  # Sub-linear search; "flat" for exact, "sq8"/"hnswsq8" int8, "ivf"/"ivfpq" for very large datasets
         "index_path": "vector_index.idx",
-        "metadata_path": "vector_metadata.pkl"
+        "metadata_path": "vector_metadata.pkl"  # ".arrow" for a memory-mappable columnar file
     }
     
     logger.info("Starting vector store creation...")
@@ -0,0 +1,218 @@
+"""
+Embedding Model Loading for CPU Inference
+
+Loads sentence transformer models as dynamically quantized int8 ONNX exports,
+so transformer MatMuls run as int8 dot products (VNNI on modern x86) instead
+of FP32. When that is unavailable, the PyTorch model runs under bfloat16
+autocast on CPUs with native bf16 support. Index builders record which of
+these encoders embedded the corpus, so queries are encoded the same way.
+"""
+
+import hashlib
+import json
+import os
+import logging
+from functools import lru_cache
+
+import torch
+from sentence_transformers import SentenceTransformer
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# File name export_dynamic_quantized_onnx_model gives the "avx512_vnni" config;
+# ONNX Runtime still runs it on CPUs without VNNI, just more slowly
+INT8_ONNX_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+
+# Sidecar written next to a FAISS index, recording the encoder its vectors came from
+ENCODER_INFO_SUFFIX = ".encoder.json"
+
+
+class BF16SentenceTransformer(SentenceTransformer):
+    """
+    SentenceTransformer whose forward pass runs under CPU bfloat16 autocast.
+    """
+
+    def forward(self, *args, **kwargs):
+        """Run the modules with Linear/MatMul ops in bfloat16 (covers encode and direct calls)."""
+        with torch.autocast(device_type="cpu", dtype=torch.bfloat16):
+            return super().forward(*args, **kwargs)
+
+
+def cpu_supports_bf16() -> bool:
+    """Whether the CPU has native bfloat16 dot products (AVX512-BF16 or AMX)."""
+    checks = ("_is_avx512_bf16_supported", "_is_amx_tile_supported")
+    return any(getattr(torch.cpu, check, lambda: False)() for check in checks)
+
+
+def physical_cpu_count() -> int:
+    """Number of physical CPU cores (logical CPUs if psutil is unavailable)."""
+    return (psutil.cpu_count(logical=False) if PSUTIL_AVAILABLE else None) or os.cpu_count() or 4
+
+
+def configure_cpu_threads() -> int:
+    """
+    Size torch's CPU thread pools to the number of physical cores.
+
+    Hyperthreads share a core's FMA units, so GEMM-heavy inference gains little
+    from them while extra threads add contention. OMP_NUM_THREADS, when set,
+    takes precedence; otherwise it and MKL_NUM_THREADS are exported so worker
+    processes started later use the same count.
+
+    Returns:
+        Number of intra-op threads in use
+    """
+    num_threads = os.environ.get("OMP_NUM_THREADS")
+    if num_threads:
+        num_threads = int(num_threads)
+    else:
+        num_threads = physical_cpu_count()
+        os.environ["OMP_NUM_THREADS"] = str(num_threads)
+        os.environ.setdefault("MKL_NUM_THREADS", str(num_threads))
+
+    torch.set_num_threads(num_threads)
+    try:
+        # One inter-op thread: encoding runs a single graph at a time
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Can only be set before the first inter-op parallel work
+        pass
+    torch.backends.mkldnn.enabled = True  # oneDNN GEMM / conv kernels
+
+    logger.info(f"Using {num_threads} CPU threads for inference")
+    return num_threads
+
+
+def load_int8_onnx_model(model_name: str, cache_dir: str = "./model_cache") -> SentenceTransformer:
+    """
+    Load a sentence transformer as an int8 ONNX model, exporting it on first use.
+
+    The quantized export is saved under cache_dir in a folder keyed by a hash
+    of model_name, so later loads skip the export. Falls back to the PyTorch
+    model (bfloat16 autocast where the CPU supports it, FP32 otherwise) if ONNX
+    export is unavailable (needs optimum[onnxruntime]).
+
+    Models are loaded once per process: callers asking for the same model and
+    cache_dir (e.g. the RAG system and the vector store) share one instance.
+
+    Args:
+        model_name: Sentence transformer model name or path
+        cache_dir: Directory for downloaded and exported models
+
+    Returns:
+        Loaded SentenceTransformer on CPU
+    """
+    return _load_int8_onnx_model(model_name, os.path.abspath(cache_dir))
+
+
+@lru_cache(maxsize=4)
+def _load_int8_onnx_model(model_name: str, cache_dir: str) -> SentenceTransformer:
+    """Per-process model cache behind load_int8_onnx_model, keyed on the absolute cache_dir."""
+    model_key = hashlib.sha1(model_name.encode('utf-8')).hexdigest()[:16]
+    quantized_dir = os.path.join(cache_dir, "onnx_int8", model_key)
+    onnx_kwargs = {"file_name": INT8_ONNX_FILE, "provider": "CPUExecutionProvider"}
+
+    try:
+        if os.path.exists(os.path.join(quantized_dir, INT8_ONNX_FILE)):
+            logger.info(f"Loading cached int8 ONNX model from {quantized_dir}")
+            model = SentenceTransformer(quantized_dir, device='cpu', backend="onnx", model_kwargs=onnx_kwargs)
+            model.encoder_precision = "int8"
+            return model
+
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        logger.info(f"Exporting {model_name} to int8 ONNX (one-time)...")
+        fp32_model = SentenceTransformer(
+            model_name,
+            device='cpu',
+            backend="onnx",
+            cache_folder=cache_dir,
+            model_kwargs={"provider": "CPUExecutionProvider"}
+        )
+        fp32_model.save(quantized_dir)
+        export_dynamic_quantized_onnx_model(fp32_model, "avx512_vnni", quantized_dir)
+        del fp32_model
+
+        model = SentenceTransformer(quantized_dir, device='cpu', backend="onnx", model_kwargs=onnx_kwargs)
+        model.encoder_precision = "int8"
+
+    except Exception as e:
+        if cpu_supports_bf16():
+            logger.warning(f"Int8 ONNX model unavailable, falling back to bfloat16 autocast: {e}")
+            model = BF16SentenceTransformer(model_name, device='cpu', cache_folder=cache_dir)
+            model.encoder_precision = "bf16"
+        else:
+            logger.warning(f"Int8 ONNX model unavailable, falling back to FP32: {e}")
+            model = SentenceTransformer(model_name, device='cpu', cache_folder=cache_dir)
+            model.encoder_precision = "fp32"
+    return model
+
+
+@lru_cache(maxsize=4)
+def load_fp32_model(model_name: str) -> SentenceTransformer:
+    """
+    Load a sentence transformer as the plain FP32 PyTorch model on CPU, once per process.
+
+    Args:
+        model_name: Sentence transformer model name or path
+
+    Returns:
+        Loaded SentenceTransformer on CPU
+    """
+    model = SentenceTransformer(model_name, device='cpu')
+    model.encoder_precision = "fp32"
+    return model
+
+
+def save_encoder_info(index_path: str, model_name: str, precision: str):
+    """
+    Record which encoder embedded an index's vectors, next to the index.
+
+    Args:
+        index_path: Path of the saved FAISS index
+        model_name: Sentence transformer model name or path
+        precision: "int8" or "bf16" for load_int8_onnx_model, "fp32"/"fp16" for the plain model
+    """
+    with open(index_path + ENCODER_INFO_SUFFIX, 'w', encoding='utf-8') as f:
+        json.dump({"model_name": model_name, "precision": precision}, f)
+
+
+def load_index_encoder(index_path: str, model_name: str, cache_dir: str = "./model_cache") -> SentenceTransformer:
+    """
+    Load the encoder an index was built with, so queries are embedded the same way as the corpus.
+
+    Indexes embedded through load_int8_onnx_model (int8, or its bfloat16 fallback)
+    get that model back; everything else, including indexes saved before the
+    encoder was recorded, gets the FP32 model.
+
+    Args:
+        index_path: Path of the FAISS index
+        model_name: Model to use if the index does not record one
+        cache_dir: Directory for downloaded and exported models
+
+    Returns:
+        Loaded SentenceTransformer on CPU
+    """
+    info_path = index_path + ENCODER_INFO_SUFFIX
+    if os.path.exists(info_path):
+        with open(info_path, encoding='utf-8') as f:
+            info = json.load(f)
+    else:
+        info = {"model_name": model_name, "precision": "fp32"}
+
+    if info["precision"] not in ("int8", "bf16"):
+        logger.info(f"Index was embedded with the {info['precision']} model; loading FP32 {info['model_name']}")
+        return load_fp32_model(info["model_name"])
+
+    model = load_int8_onnx_model(info["model_name"], cache_dir)
+    if model.encoder_precision != info["precision"]:
+        logger.warning(f"Index was embedded in {info['precision']} but queries will be encoded in "
+                       f"{model.encoder_precision}; rebuild the index for exact scores")
+    return model
@@ -11,23 +11,78 @@ import logging
 import json
 import time
 import re
+import hashlib
 from datetime import datetime
-from typing import Dict, Any, Optional, Generator
-from flask import Flask, render_template, request, jsonify, Response, stream_with_context, g
+from typing import Dict, Any, List, Optional, Generator
+from flask import Flask, render_template, request, Response, stream_with_context, g
 from flask_cors import CORS
+import requests
+from requests.adapters import HTTPAdapter
+from cachetools import LRUCache, TTLCache
 import threading
+import queue
 from contextlib import contextmanager
 import html
 
+# Fast JSON encoding for responses and SSE frames
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Production WSGI server
+try:
+    from waitress import serve
+    WAITRESS_AVAILABLE = True
+except ImportError:
+    WAITRESS_AVAILABLE = False
+
 # Add src directory to path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from rag_system import HealthRAGSystem
+from rag_system import HealthRAGSystem, groq_api_key_var
+from semantic_cache import SemanticCache
+from query_batcher import QueryBatcher
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Control characters except newlines and tabs, mapped to None for str.translate
+_CTRL_TRANS = dict.fromkeys(
+    list(range(0x00, 0x09)) + [0x0B, 0x0C] + list(range(0x0E, 0x20)) + [0x7F], None
+)
+
+# Streamed tokens are coalesced into frames of at least this many characters,
+# or whatever has accumulated after this many seconds
+SSE_FLUSH_CHARS = 256
+SSE_FLUSH_INTERVAL = 0.025
+
+# Display strings for the first sources of a response, built once instead of per request
+_MAX_PRECOMPUTED_SOURCES = 32
+_SRC_IDS = [f'source_{i}' for i in range(_MAX_PRECOMPUTED_SOURCES)]
+_SRC_TITLES = [f'Source {i + 1}' for i in range(_MAX_PRECOMPUTED_SOURCES)]
+_SRC_CONTENTS = [f'Relevant information from source {i + 1}' for i in range(_MAX_PRECOMPUTED_SOURCES)]
+
+# Session ID pattern, compiled once instead of on every request
+_SESSION_RE = re.compile(r'[^a-zA-Z0-9_-]')
+
+# Pooled keep-alive connections to the Groq API, shared by all requests
+_GROQ_SESSION = requests.Session()
+_GROQ_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# Groq keys that pass the format check and were accepted by the API recently,
+# keyed by their SHA-256 digest so plaintext keys are never held
+_GROQ_KEY_RE = re.compile(r'^gsk_[A-Za-z0-9]{40,}$')
+_KEY_CACHE = TTLCache(maxsize=4096, ttl=600)
+_KEY_CACHE_LOCK = threading.Lock()
+
+# Query embeddings and their search hits, keyed by a digest of the message text.
+# The index does not change at runtime, so the hits stay valid.
+_EMB_CACHE = LRUCache(maxsize=8192)
+_EMB_CACHE_LOCK = threading.Lock()
+
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)
@@ -36,9 +91,31 @@ CORS(app)
 rag_system = None
 system_info = {}
 
+# Entity tag of system_info, fixed once the RAG system is initialized
+info_etag = None
+
+# Responses reused for near-duplicate questions
+semantic_cache = None
+
+# Encodes queries from concurrent requests together
+query_batcher = None
+
+# (second, ISO string) of the last formatted timestamp, swapped as one tuple
+_ts_cache = (0, "")
+
+def iso_now() -> str:
+    """Current local time as an ISO string, formatted at most once per second."""
+    global _ts_cache
+    t = int(time.time())
+    cached_t, cached_str = _ts_cache
+    if t != cached_t:
+        cached_str = datetime.fromtimestamp(t).isoformat()
+        _ts_cache = (t, cached_str)
+    return cached_str
+
 def initialize_rag_system():
     """Initialize the RAG system."""
-    global rag_system, system_info
+    global rag_system, system_info, info_etag, semantic_cache, query_batcher
     
     if rag_system is not None:
         return rag_system
@@ -49,7 +126,8 @@ def initialize_rag_system():
             "model_name": "sentence-transformers/all-MiniLM-L6-v2",
             "index_path": "vector_index.idx",
             "metadata_path": "vector_metadata.pkl",
-            "groq_model": "llama-3.1-8b-instant"
+            "groq_model": "llama-3.1-8b-instant",
+            "response_cache_path": "rag_response_cache.sqlite"
         }
         
         # Get Groq API key
@@ -60,14 +138,20 @@ def initialize_rag_system():
         # Initialize RAG system
         rag_system = HealthRAGSystem(**config, groq_api_key=groq_api_key)
         rag_system.load_search_system()
+        # Every query path encodes with the RAG system's embedder, which is the
+        # encoder recorded for the index, so cached and batched lookups match it
+        semantic_cache = SemanticCache(rag_system.embedder.get_sentence_embedding_dimension())
+        query_batcher = QueryBatcher(rag_system.embedder, index=rag_system.faiss_index, k=5)
         
         # Store system info
         system_info = {
             "model": config["groq_model"],
             "vectors": rag_system.faiss_index.ntotal,
             "embedding_model": config["model_name"],
-            "timestamp": datetime.now().isoformat()
+            "embedding_precision": rag_system.embedder.encoder_precision,
+            "timestamp": iso_now()
         }
+        info_etag = hashlib.md5(dumps_json(system_info)).hexdigest()
         
         logger.info("RAG system initialized successfully")
         return rag_system
@@ -81,6 +165,14 @@ def index():
     """Main chat interface."""
     return render_template('chat.html')
 
+def not_modified(etag: str) -> Optional[Response]:
+    """Return an empty 304 response if the client already holds this entity tag."""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
 @app.route('/api/health')
 def health_check():
     """Health check endpoint."""
@@ -88,18 +180,25 @@ def health_check():
         if rag_system is None:
             initialize_rag_system()
         
-        return jsonify({
+        # Everything but the timestamp is fixed after initialization
+        cached = not_modified(info_etag)
+        if cached is not None:
+            return cached
+        
+        response = ojsonify({
             'status': 'healthy',
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': iso_now(),
             'vectors': rag_system.faiss_index.ntotal if rag_system else 0,
             'model': system_info.get('model', 'unknown')
         })
+        response.set_etag(info_etag)
+        return response
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}")
-        return jsonify({
+        return ojsonify({
             'status': 'unhealthy',
             'error': str(e),
-            'timestamp': datetime.now().isoformat()
+            'timestamp': iso_now()
         }), 500
 
 @app.route('/api/info')
@@ -109,56 +208,145 @@ def api_info():
         if rag_system is None:
             initialize_rag_system()
         
-        return jsonify(system_info)
+        # Cache statistics are the only part of the info that changes at runtime
+        etag = info_etag
+        cache_stats = semantic_cache.stats() if semantic_cache is not None else None
+        if cache_stats is not None:
+            etag = f"{info_etag}-{cache_stats['hits']}-{cache_stats['misses']}-{cache_stats['entries']}"
+        
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        
+        info = dict(system_info)
+        if cache_stats is not None:
+            info['semantic_cache'] = cache_stats
+        response = ojsonify(info)
+        response.set_etag(etag)
+        return response
     except Exception as e:
         logger.error(f"Failed to get API info: {str(e)}")
-        return jsonify({
+        return ojsonify({
             'error': str(e),
-            'timestamp': datetime.now().isoformat()
+            'timestamp': iso_now()
         }), 500
 
 @contextmanager
 def temporary_api_key(user_api_key: Optional[str]):
-    """Context manager for safely handling user API keys without race conditions."""
+    """Context manager that makes Groq calls in the current request use the user's API key.
+    
+    The key is held in a ContextVar rather than os.environ, so concurrent
+    requests never see each other's keys.
+    """
     if not user_api_key:
         yield
         return
     
-    # Store original key
-    original_key = os.environ.get('GROQ_API_KEY')
-    
+    token = groq_api_key_var.set(user_api_key)
     try:
-        # Set user's key temporarily
-        os.environ['GROQ_API_KEY'] = user_api_key
         logger.info("Using user-provided API key for request")
         yield
     finally:
-        # Always restore original key
-        if original_key:
-            os.environ['GROQ_API_KEY'] = original_key
-        else:
-            # If there was no original key, remove the user key
-            os.environ.pop('GROQ_API_KEY', None)
+        groq_api_key_var.reset(token)
         logger.debug("API key restored")
 
+def _sanitize_fast(text: str, max_length: int) -> str:
+    """Truncate, collapse whitespace, escape HTML and drop control characters.
+
+    str.split()/join strips and collapses whitespace runs in one C-level pass,
+    which is equivalent to strip() followed by re.sub(r'\s+', ' ', ...). Escaping
+    never produces whitespace, so doing it after the collapse gives the same
+    result as the original escape-first order.
+    """
+    return html.escape(' '.join(text[:max_length].split())).translate(_CTRL_TRANS)
+
 def sanitize_input(text: str, max_length: int = 5000) -> str:
     """Sanitize user input to prevent injection attacks."""
     if not text or not isinstance(text, str):
         return ""
     
-    # Limit length
-    text = text[:max_length]
+    return _sanitize_fast(text, max_length)
+
+def dumps_json(obj: Any) -> bytes:
+    """Encode obj as UTF-8 JSON, with orjson when available."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj).encode('utf-8')
+
+def ojsonify(obj: Any, status: int = 200) -> Response:
+    """Drop-in replacement for jsonify that encodes with orjson."""
+    return Response(dumps_json(obj), status=status, mimetype='application/json')
+
+def sse_frame(event_type: str, data: Dict[str, Any]) -> bytes:
+    """Encode one server-sent event frame."""
+    return b"data: " + dumps_json({'type': event_type, 'data': data}) + b"\n\n"
+
+def encode_and_search_cached(text: str):
+    """
+    Embed a message and search the index through the query batcher, reusing
+    the result for messages seen before.
     
-    # Remove potentially dangerous characters
-    text = html.escape(text)
+    Returns:
+        Tuple of (embedding, scores, ids), each with a leading dimension of 1
+    """
+    key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    with _EMB_CACHE_LOCK:
+        cached = _EMB_CACHE.get(key)
+    if cached is not None:
+        return cached
     
-    # Remove excessive whitespace
-    text = re.sub(r'\s+', ' ', text.strip())
+    cached = query_batcher.encode_and_search(text)
+    with _EMB_CACHE_LOCK:
+        _EMB_CACHE[key] = cached
+    return cached
+
+def _produce_stream(rag: HealthRAGSystem, message: str, out: queue.Queue, stop: threading.Event):
+    """
+    Run the blocking RAG call and Groq stream in a worker thread.
     
-    # Remove control characters except newlines and tabs
-    text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', text)
+    Puts ('token', str) items on out, then ('docs', relevant_docs), or
+    ('error', exception) if anything fails. Stops early once stop is set,
+    e.g. when the client disconnects.
+    """
+    try:
+        _, scores, ids = encode_and_search_cached(message)
+        relevant_docs = rag.format_search_results(scores, ids)
+        result = rag.get_conversation_context(message, stream=True, relevant_docs=relevant_docs)
+        for token in result['response']:
+            if stop.is_set():
+                return
+            out.put(('token', token))
+        out.put(('docs', result['relevant_docs']))
+    except Exception as e:
+        out.put(('error', e))
+
+def build_sources(relevant_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Format retrieved documents as the sources list sent to the frontend."""
+    n = len(relevant_docs)
+    if n <= _MAX_PRECOMPUTED_SOURCES:
+        ids, titles, contents = _SRC_IDS, _SRC_TITLES, _SRC_CONTENTS
+    else:
+        ids = [f'source_{i}' for i in range(n)]
+        titles = [f'Source {i + 1}' for i in range(n)]
+        contents = [f'Relevant information from source {i + 1}' for i in range(n)]
     
-    return text
+    return [
+        {
+            'id': ids[i],
+            'title': titles[i],
+            'content': contents[i],
+            'relevanceScore': doc['score'],
+            'metadata': doc['metadata']
+        }
+        for i, doc in enumerate(relevant_docs)
+    ]
+
+def build_compact_sources(relevant_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Format retrieved documents as compact {id, score, meta} entries; the frontend derives display strings from id."""
+    return [
+        {'id': i, 'score': round(doc['score'], 4), 'meta': doc['metadata']}
+        for i, doc in enumerate(relevant_docs)
+    ]
 
 def validate_session_id(session_id: str) -> str:
     """Validate and sanitize session ID."""
@@ -166,7 +354,7 @@ def validate_session_id(session_id: str) -> str:
         return f'session_{int(time.time())}'
     
     # Only allow alphanumeric characters, underscores, and hyphens
-    session_id = re.sub(r'[^a-zA-Z0-9_-]', '', session_id)
+    session_id = _SESSION_RE.sub('', session_id)
     
     # Limit length
     session_id = session_id[:100]
@@ -193,7 +381,7 @@ def chat():
             # Get request data
             data = request.get_json()
             if not data:
-                return jsonify({
+                return ojsonify({
                     'error': 'Invalid request',
                     'response': 'No data provided.'
                 }), 400
@@ -205,56 +393,57 @@ def chat():
             settings = data.get('settings', {}) if isinstance(data.get('settings'), dict) else {}
             
             if not message:
-                return jsonify({
+                return ojsonify({
                     'error': 'Empty message',
                     'response': 'Please enter a health question.'
                 }), 400
             
             # Additional validation
             if len(message) < 3:
-                return jsonify({
+                return ojsonify({
                     'error': 'Message too short',
                     'response': 'Please enter a more detailed health question.'
                 }), 400
             
+            # Reuse the answer to a near-identical earlier question if there is one
+            query_embedding, scores, ids = encode_and_search_cached(message)
+            result = semantic_cache.lookup(query_embedding)
+            
             # Generate response
-            result = rag_system.get_conversation_context(message)
+            if result is None:
+                relevant_docs = rag_system.format_search_results(scores, ids)
+                result = rag_system.get_conversation_context(message, relevant_docs=relevant_docs)
+                if 'error' not in result['metadata']:
+                    semantic_cache.store(query_embedding, result)
+            else:
+                # Fresh timestamp on a copy, so the stored entry is left untouched
+                result = {**result, 'metadata': {**result['metadata'], 'timestamp': iso_now(), 'cached': True}}
         
             # Format response with enhanced metadata
             response_data = {
                 'response': result['response'],
                 'timestamp': result['metadata']['timestamp'],
-                'sources': result['metadata']['relevant_docs_count'],
                 'topScore': result['metadata']['top_doc_score'],
+                'sources_count': result['metadata']['relevant_docs_count'],
                 'sessionId': session_id,
                 'metadata': {
                     'model_used': result['metadata']['model_used'],
                     'response_length': result['metadata']['response_length'],
                     'processing_time': result['metadata'].get('processing_time', 0),
-                    'sources_used': result['metadata']['relevant_docs_count']
+                    'sources_used': result['metadata']['relevant_docs_count'],
+                    'cached': result['metadata'].get('cached', False)
                 },
-                'sources': []
+                'sources': build_compact_sources(result['relevant_docs'])
             }
             
-            # Add source information
-            for i, doc in enumerate(result['relevant_docs']):
-                source_info = {
-                    'id': f'source_{i}',
-                    'title': f'Source {i + 1}',
-                    'content': f'Relevant information from source {i + 1}',
-                    'relevanceScore': doc['score'],
-                    'metadata': doc['metadata']
-                }
-                response_data['sources'].append(source_info)
-            
-            return jsonify(response_data)
+            return ojsonify(response_data)
             
         except Exception as e:
             logger.error(f"Error in chat endpoint: {str(e)}")
-            return jsonify({
+            return ojsonify({
                 'error': str(e),
                 'response': 'I apologize, but I\'m experiencing technical difficulties. Please try again or consult a healthcare professional for immediate medical concerns.',
-                'timestamp': datetime.now().isoformat()
+                'timestamp': iso_now()
             }), 500
 
 @app.route('/api/chat/stream', methods=['POST'])
@@ -272,45 +461,63 @@ def chat_stream():
         settings = data.get('settings', {})
         
         if not message:
-            return jsonify({'error': 'Empty message'}), 400
+            return ojsonify({'error': 'Empty message'}), 400
         
         def generate_stream():
+            # Retrieval and the Groq stream run in a worker thread so reading
+            # from Groq never waits on a slow client, and buffered tokens are
+            # flushed on time even while no new token arrives
+            events = queue.Queue()
+            stop = threading.Event()
+            threading.Thread(
+                target=_produce_stream, args=(rag_system, message, events, stop), daemon=True
+            ).start()
+            
             try:
                 # Send initial response
-                yield f"data: {json.dumps({'type': 'start', 'data': {'message': 'Starting response generation...'}})}\n\n"
-                
-                # Generate response
-                result = rag_system.get_conversation_context(message)
+                yield sse_frame('start', {'message': 'Starting response generation...'})
                 
-                # Send content in chunks to simulate streaming
-                content = result['response']
-                chunk_size = 50
-                
-                for i in range(0, len(content), chunk_size):
-                    chunk = content[i:i + chunk_size]
-                    yield f"data: {json.dumps({'type': 'content', 'data': {'chunk': chunk}})}\n\n"
-                    time.sleep(0.05)  # Small delay for streaming effect
+                # Forward tokens as Groq produces them, coalescing small deltas
+                buf = []
+                buf_len = 0
+                flush_at = None
+                while True:
+                    timeout = None if flush_at is None else max(0.0, flush_at - time.monotonic())
+                    try:
+                        kind, value = events.get(timeout=timeout)
+                    except queue.Empty:
+                        kind = None
+                    
+                    if kind == 'token':
+                        buf.append(value)
+                        buf_len += len(value)
+                        if flush_at is None:
+                            flush_at = time.monotonic() + SSE_FLUSH_INTERVAL
+                        if buf_len < SSE_FLUSH_CHARS:
+                            continue
+                    elif kind == 'error':
+                        raise value
+                    
+                    if buf:
+                        yield sse_frame('content', {'chunk': ''.join(buf)})
+                        buf.clear()
+                        buf_len = 0
+                        flush_at = None
+                    if kind == 'docs':
+                        relevant_docs = value
+                        break
                 
                 # Send sources
-                sources = []
-                for i, doc in enumerate(result['relevant_docs']):
-                    source_info = {
-                        'id': f'source_{i}',
-                        'title': f'Source {i + 1}',
-                        'content': f'Relevant information from source {i + 1}',
-                        'relevanceScore': doc['score'],
-                        'metadata': doc['metadata']
-                    }
-                    sources.append(source_info)
-                
-                yield f"data: {json.dumps({'type': 'sources', 'data': {'sources': sources}})}\n\n"
+                yield sse_frame('sources', {'sources': build_sources(relevant_docs)})
                 
                 # Send completion
-                yield f"data: {json.dumps({'type': 'done', 'data': {'timestamp': datetime.now().isoformat()}})}\n\n"
+                yield sse_frame('done', {'timestamp': iso_now()})
                 
             except Exception as e:
                 logger.error(f"Error in streaming: {str(e)}")
-                yield f"data: {json.dumps({'type': 'error', 'data': {'error': str(e)}})}\n\n"
+                yield sse_frame('error', {'error': str(e)})
+            finally:
+                stop.set()
         
         return Response(
             stream_with_context(generate_stream()),
@@ -325,7 +532,7 @@ def chat_stream():
         
     except Exception as e:
         logger.error(f"Error in streaming endpoint: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+        return ojsonify({'error': str(e)}), 500
 
 @app.route('/api/feedback', methods=['POST'])
 def feedback():
@@ -339,14 +546,14 @@ def feedback():
         # Log feedback (in a real app, you'd save to database)
         logger.info(f"Feedback received - Message: {message_id}, Rating: {rating}, Text: {feedback_text}")
         
-        return jsonify({
+        return ojsonify({
             'status': 'success',
             'message': 'Feedback received successfully'
         })
         
     except Exception as e:
         logger.error(f"Error in feedback endpoint: {str(e)}")
-        return jsonify({
+        return ojsonify({
             'error': str(e),
             'message': 'Failed to process feedback'
         }), 500
@@ -359,15 +566,30 @@ def validate_api_key():
         api_key = data.get('apiKey', '').strip()
         
         if not api_key:
-            return jsonify({
+            return ojsonify({
                 'valid': False,
                 'error': 'API key is required'
             }), 400
         
-        # Test the API key by making a simple request to Groq
-        import requests
+        # Reject malformed keys without a network round-trip
+        if not _GROQ_KEY_RE.match(api_key):
+            return ojsonify({
+                'valid': False,
+                'error': 'Invalid API key'
+            }), 400
         
-        test_response = requests.post(
+        # Skip the round-trip for keys Groq accepted recently
+        key_digest = hashlib.sha256(api_key.encode()).digest()
+        with _KEY_CACHE_LOCK:
+            recently_valid = _KEY_CACHE.get(key_digest, False)
+        if recently_valid:
+            return ojsonify({
+                'valid': True,
+                'message': 'API key is valid'
+            })
+        
+        # Test the API key by making a simple request to Groq
+        test_response = _GROQ_SESSION.post(
             'https://api.groq.com/openai/v1/chat/completions',
             headers={
                 'Authorization': f'Bearer {api_key}',
@@ -382,24 +604,27 @@ def validate_api_key():
         )
         
         if test_response.status_code == 200:
-            return jsonify({
+            # Only successes are cached so a transient failure never sticks
+            with _KEY_CACHE_LOCK:
+                _KEY_CACHE[key_digest] = True
+            return ojsonify({
                 'valid': True,
                 'message': 'API key is valid'
             })
         else:
-            return jsonify({
+            return ojsonify({
                 'valid': False,
                 'error': 'Invalid API key'
             }), 400
             
     except requests.exceptions.Timeout:
-        return jsonify({
+        return ojsonify({
             'valid': False,
             'error': 'API key validation timed out'
         }), 408
     except Exception as e:
         logger.error(f"Error validating API key: {str(e)}")
-        return jsonify({
+        return ojsonify({
             'valid': False,
             'error': 'Failed to validate API key'
         }), 500
@@ -407,25 +632,25 @@ def validate_api_key():
 @app.route('/api/sessions', methods=['GET'])
 def get_sessions():
     """Get chat sessions (placeholder for future implementation)."""
-    return jsonify({'sessions': []})
+    return ojsonify({'sessions': []})
 
 @app.route('/api/sessions/<session_id>', methods=['DELETE'])
 def delete_session(session_id):
     """Delete a chat session (placeholder for future implementation)."""
-    return jsonify({'status': 'success', 'message': 'Session deleted'})
+    return ojsonify({'status': 'success', 'message': 'Session deleted'})
 
 @app.errorhandler(404)
 def not_found(error):
     """Handle 404 errors."""
-    return jsonify({'error': 'Endpoint not found'}), 404
+    return ojsonify({'error': 'Endpoint not found'}), 404
 
 @app.errorhandler(500)
 def internal_error(error):
     """Handle 500 errors."""
-    return jsonify({'error': 'Internal server error'}), 500
+    return ojsonify({'error': 'Internal server error'}), 500
 
 def create_templates():
-    """Create HTML templates if they don't exist."""
+    """Create HTML templates if they don't exist or are out of date."""
     templates_dir = os.path.join(os.path.dirname(__file__), 'templates')
     os.makedirs(templates_dir, exist_ok=True)
     
@@ -509,7 +734,16 @@ def create_templates():
 </body>
 </html>'''
     
-    with open(os.path.join(templates_dir, 'chat.html'), 'w', encoding='utf-8') as f:
+    # The template ships with the source tree, so normally it is already current
+    chat_path = os.path.join(templates_dir, 'chat.html')
+    new_hash = hashlib.sha1(chat_html.encode('utf-8')).hexdigest()
+    if os.path.exists(chat_path):
+        with open(chat_path, 'rb') as f:
+            if hashlib.sha1(f.read()).hexdigest() == new_hash:
+                logger.debug("chat.html is up to date")
+                return
+    
+    with open(chat_path, 'w', encoding='utf-8') as f:
         f.write(chat_html)
 
 def main():
@@ -541,7 +775,15 @@ def main():
     print("📱 Frontend: http://localhost:3000 (if running)")
     print("🛑 Press Ctrl+C to stop the server")
     
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    # Requests spend most of their time waiting on Groq, which releases the
+    # GIL, so a generous thread pool overlaps those waits
+    if WAITRESS_AVAILABLE:
+        threads = min(32, (os.cpu_count() or 4) * 4)
+        print(f"🧵 Serving with waitress ({threads} threads)")
+        serve(app, host='0.0.0.0', port=5000, threads=threads)
+    else:
+        print("⚠️ waitress not installed, falling back to the Flask development server")
+        app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
 
 if __name__ == "__main__":
     main()
@@ -7,19 +7,34 @@ for i5 processors without GPU requirements.
 
 import pickle
 import numpy as np
+import torch
 import faiss
-from sentence_transformers import SentenceTransformer
-from typing import List, Tuple, Dict, Any
+import pyarrow as pa
+from typing import List, Tuple, Dict, Any, Optional
 import logging
 import os
-from tqdm import tqdm
 import time
-import torch
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from tqdm import tqdm
+
+from chunking import load_chunked_documents, count_chunks
+from embedding_models import (
+    configure_cpu_threads, load_index_encoder, load_int8_onnx_model, physical_cpu_count, save_encoder_info
+)
+from rag_system import source_content_type
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# "auto" index selection switches from exact search to HNSW above this many vectors
+HNSW_MIN_VECTORS = 5000
+
+# FAISS warns below 39 training points per IVF centroid
+MIN_POINTS_PER_CENTROID = 39
+IVF_NPROBE = 16
+
 
 class OptimizedHealthVectorStore:
     """
@@ -39,6 +54,12 @@ class OptimizedHealthVectorStore:
         self.metadata = []
         self.embedding_dim = None
         
+        # Query text -> embedding bytes, so repeated questions skip the encoder
+        self._cached_query_embedding = lru_cache(maxsize=1024)(self._encode_query)
+        
+        # FAISS otherwise inherits the OpenMP default, often 1 thread in containers
+        faiss.omp_set_num_threads(int(os.environ.get("FAISS_NUM_THREADS") or physical_cpu_count()))
+        
     def load_embedding_model(self):
         """Load the sentence transformer model with CPU optimization."""
         logger.info(f"Loading optimized embedding model: {self.model_name}")
@@ -47,16 +68,15 @@ class OptimizedHealthVectorStore:
         import os
         os.environ["CUDA_VISIBLE_DEVICES"] = ""
         
-        # Load model with CPU optimization
-        self.embedder = SentenceTransformer(
-            self.model_name,
-            device='cpu',  # Force CPU usage
-            cache_folder='./model_cache'  # Local cache
-        )
+        # Size thread pools before the first forward pass
+        configure_cpu_threads()
+        
+        # Load model as a dynamically quantized int8 ONNX export
+        self.embedder = load_int8_onnx_model(self.model_name, cache_dir='./model_cache')
+        self._cached_query_embedding.cache_clear()
         
         # Optimize for CPU inference
         self.embedder.eval()
-        torch.set_num_threads(4)  # Optimize for i5 CPU
         
         self.embedding_dim = self.embedder.get_sentence_embedding_dimension()
         logger.info(f"Model loaded. Embedding dimension: {self.embedding_dim}")
@@ -64,7 +84,8 @@ class OptimizedHealthVectorStore:
         
     def generate_embeddings_optimized(self, chunked_docs: List, 
                                     batch_size: int = 128,  # Smaller batch for CPU
-                                    show_progress: bool = True) -> np.ndarray:
+                                    show_progress: bool = True,
+                                    embeddings_path: Optional[str] = None) -> np.ndarray:
         """
         Generate embeddings for all chunked documents with CPU optimization.
         
@@ -72,9 +93,11 @@ class OptimizedHealthVectorStore:
             chunked_docs: List of chunked Document objects
             batch_size: Batch size for embedding generation (smaller for CPU)
             show_progress: Whether to show progress bar
+            embeddings_path: If set, write embeddings to a np.memmap file at this
+                path instead of RAM, for corpora whose vectors do not fit in memory
             
         Returns:
-            numpy array of embeddings
+            numpy array (or memmap) of embeddings
         """
         if self.embedder is None:
             self.load_embedding_model()
@@ -88,20 +111,38 @@ class OptimizedHealthVectorStore:
         # Generate embeddings with CPU optimization
         start_time = time.time()
         
-        # Process in smaller batches for CPU efficiency
-        all_embeddings = []
-        for i in tqdm(range(0, len(texts), batch_size), desc="Generating embeddings"):
-            batch_texts = texts[i:i + batch_size]
-            batch_embeddings = self.embedder.encode(
-                batch_texts,
-                convert_to_numpy=True,
-                show_progress_bar=False,
-                batch_size=min(batch_size, len(batch_texts))
-            )
-            all_embeddings.append(batch_embeddings)
-        
-        # Combine all embeddings
-        embeddings = np.vstack(all_embeddings)
+        # Encode shortest first so each batch pads to a similar length
+        order = np.argsort(
+            np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts)),
+            kind="stable"
+        )
+        
+        # Preallocate the output so each batch is written straight into its rows
+        # (in document order) and no second full-size copy is ever held
+        shape = (len(texts), self.embedding_dim)
+        if embeddings_path:
+            embeddings = np.memmap(embeddings_path, dtype=np.float32, mode='w+', shape=shape)
+        else:
+            embeddings = np.empty(shape, dtype=np.float32)
+        
+        # The Rust fast tokenizer pads the next batch on a helper thread while the
+        # model runs the current one; both release the GIL
+        batches = [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="tokenizer") as tokenizer:
+            pending = tokenizer.submit(self.embedder.tokenize, [texts[i] for i in batches[0]]) if batches else None
+            for n, batch_idx in enumerate(tqdm(batches, desc="Generating embeddings", disable=not show_progress)):
+                features = pending.result()
+                if n + 1 < len(batches):
+                    pending = tokenizer.submit(self.embedder.tokenize, [texts[i] for i in batches[n + 1]])
+                
+                with torch.inference_mode():
+                    output = self.embedder(features)['sentence_embedding']
+                    # inner product == cosine similarity
+                    output = torch.nn.functional.normalize(output, p=2, dim=1)
+                embeddings[batch_idx] = output.float().numpy()
+        
+        if embeddings_path:
+            embeddings.flush()
         
         end_time = time.time()
         logger.info(f"Embeddings generated in {end_time - start_time:.2f} seconds")
@@ -111,51 +152,101 @@ class OptimizedHealthVectorStore:
         return embeddings
     
     def create_faiss_index(self, embeddings: np.ndarray, 
-                          index_type: str = "flat") -> faiss.Index:
+                          index_type: str = "auto") -> faiss.Index:
         """
-        Create FAISS index from embeddings.
+        Create FAISS index from normalized embeddings, scored by inner product (cosine similarity).
         
         Args:
             embeddings: numpy array of embeddings
-            index_type: Type of FAISS index ("flat" or "ivf")
+            index_type: Type of FAISS index ("flat", "sq", "sq8", "ivf", "ivfpq", "hnsw", or
+                        "auto" for hnsw above HNSW_MIN_VECTORS vectors and flat otherwise)
             
         Returns:
             FAISS index
         """
+        if index_type == "auto":
+            index_type = "hnsw" if len(embeddings) > HNSW_MIN_VECTORS else "flat"
         logger.info(f"Creating FAISS {index_type} index...")
         
+        # Inner product only equals cosine similarity on unit vectors (idempotent if already normalized)
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        faiss.normalize_L2(embeddings)
         embedding_dim = embeddings.shape[1]
         
         if index_type == "flat":
-            # Simple L2 distance index - good for small to medium datasets
-            index = faiss.IndexFlatL2(embedding_dim)
+            # Exact search - good for small to medium datasets
+            index = faiss.IndexFlatIP(embedding_dim)
+        elif index_type in ("sq", "sq8"):
+            # Exhaustive search over scalar-quantized codes: 2 bytes (fp16) or
+            # 1 byte (8-bit) per dimension, so each scan reads 2-4x less memory
+            qtype = faiss.ScalarQuantizer.QT_fp16 if index_type == "sq" else faiss.ScalarQuantizer.QT_8bit
+            index = faiss.IndexScalarQuantizer(embedding_dim, qtype, faiss.METRIC_INNER_PRODUCT)
+            index.train(embeddings)
         elif index_type == "ivf":
             # Inverted file index - better for large datasets
-            nlist = min(100, len(embeddings) // 100)  # Number of clusters
-            quantizer = faiss.IndexFlatL2(embedding_dim)
-            index = faiss.IndexIVFFlat(quantizer, embedding_dim, nlist)
+            # ~4*sqrt(N) clusters, capped so each centroid still gets enough training points
+            nlist = max(1, min(int(4 * np.sqrt(len(embeddings))), len(embeddings) // MIN_POINTS_PER_CENTROID))
+            quantizer = faiss.IndexFlatIP(embedding_dim)
+            index = faiss.IndexIVFFlat(quantizer, embedding_dim, nlist, faiss.METRIC_INNER_PRODUCT)
             index.train(embeddings)
+            index.nprobe = min(IVF_NPROBE, nlist)
+        elif index_type == "ivfpq":
+            # Product-quantized inverted file index: M one-byte codes per vector
+            # (48 bytes for 384-d) instead of 4 bytes per dimension
+            if len(embeddings) < 256 * MIN_POINTS_PER_CENTROID:
+                logger.warning(f"Too few vectors ({len(embeddings)}) to train PQ codebooks; using a flat index")
+                return self.create_faiss_index(embeddings, index_type="flat")
+            nlist = min(1024, len(embeddings) // MIN_POINTS_PER_CENTROID)
+            pq_m = max(m for m in range(1, 49) if embedding_dim % m == 0)  # 48 for 384/768-d models
+            quantizer = faiss.IndexFlatIP(embedding_dim)
+            index = faiss.IndexIVFPQ(quantizer, embedding_dim, nlist, pq_m, 8, faiss.METRIC_INNER_PRODUCT)
+            index.train(embeddings)
+            index.nprobe = min(IVF_NPROBE, nlist)
+        elif index_type == "hnsw":
+            # Graph-based search - O(log N) queries with high recall
+            index = faiss.IndexHNSWFlat(embedding_dim, 32, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = 200
+            index.hnsw.efSearch = 64
         else:
             raise ValueError(f"Unsupported index type: {index_type}")
         
         # Add embeddings to index
-        index.add(embeddings.astype('float32'))
+        index.add(embeddings)
         
         logger.info(f"FAISS index created with {index.ntotal} vectors")
         self.faiss_index = index
         
         return index
     
-    def search(self, query: str, k: int = 5) -> List[Tuple[float, Dict]]:
+    def _encode_query(self, text: str) -> bytes:
+        """Encode one normalized query; bytes keep the cached value immutable."""
+        embedding = self.embedder.encode([text], convert_to_numpy=True, normalize_embeddings=True)
+        return np.ascontiguousarray(embedding, dtype=np.float32).tobytes()
+    
+    def embed_query(self, query: str) -> np.ndarray:
+        """
+        Get the normalized embedding of a query, reusing it for repeated queries.
+        
+        Args:
+            query: Query string (matched case- and surrounding-whitespace-insensitively)
+            
+        Returns:
+            Read-only float32 array of shape (1, dim)
+        """
+        return np.frombuffer(self._cached_query_embedding(query.strip().lower()), dtype=np.float32).reshape(1, -1)
+    
+    def search(self, query: str, k: int = 5, ef_search: Optional[int] = None) -> List[Tuple[float, Dict]]:
         """
         Search for similar documents using a query string.
         
         Args:
             query: Query string
             k: Number of results to return
+            ef_search: HNSW search breadth for this query (higher = better recall, slower);
+                       defaults to the index setting
             
         Returns:
-            List of (score, metadata) tuples
+            List of (score, metadata) tuples, highest cosine similarity first
         """
         if self.faiss_index is None:
             raise ValueError("FAISS index not initialized. Call create_faiss_index first.")
@@ -164,18 +255,56 @@ class OptimizedHealthVectorStore:
             self.load_embedding_model()
         
         # Generate embedding for query
-        query_embedding = self.embedder.encode([query], convert_to_numpy=True)
+        query_embedding = self.embed_query(query)
         
         # Search in FAISS index
-        scores, indices = self.faiss_index.search(query_embedding.astype('float32'), k)
+        params = None
+        if ef_search is not None and isinstance(self.faiss_index, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW(efSearch=ef_search)
+        scores, indices = self.faiss_index.search(
+            np.ascontiguousarray(query_embedding, dtype=np.float32), k, params=params
+        )
+        
+        # Return results with metadata; -1 ids pad rows with fewer than k hits
+        valid = (indices[0] >= 0) & (indices[0] < len(self.metadata))
+        rows = self._metadata_rows(indices[0][valid].tolist())
+        
+        return list(zip(scores[0][valid].tolist(), rows))
+    
+    def search_batch(self, queries: List[str], k: int = 5) -> List[List[Tuple[float, Dict]]]:
+        """
+        Search for several query strings with one encode call and one FAISS search.
         
-        # Return results with metadata
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx < len(self.metadata):
-                results.append((float(score), self.metadata[idx]))
+        Args:
+            queries: Query strings
+            k: Number of results to return per query
+            
+        Returns:
+            One list of (score, metadata) tuples per query, in query order
+        """
+        if self.faiss_index is None:
+            raise ValueError("FAISS index not initialized. Call create_faiss_index first.")
         
-        return results
+        if self.embedder is None:
+            self.load_embedding_model()
+        
+        query_embeddings = self.embedder.encode(
+            queries, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False
+        )
+        scores, indices = self.faiss_index.search(np.ascontiguousarray(query_embeddings, dtype=np.float32), k)
+        
+        valid = (indices >= 0) & (indices < len(self.metadata))
+        return [
+            list(zip(row_scores[row_valid].tolist(), self._metadata_rows(row_indices[row_valid].tolist())))
+            for row_scores, row_indices, row_valid in zip(scores, indices, valid)
+        ]
+    
+    def _metadata_rows(self, indices: List[int]) -> List[Dict]:
+        """Metadata of several vectors, from either a list of dicts or an Arrow table."""
+        if isinstance(self.metadata, pa.Table):
+            rows = self.metadata.take(pa.array(indices, type=pa.int64())).to_pylist()
+            return [{key: value for key, value in row.items() if value is not None} for row in rows]
+        return [self.metadata[idx] for idx in indices]
     
     def save_vector_store(self, index_path: str = "vector_index.idx", 
                          metadata_path: str = "vector_metadata.pkl"):
@@ -184,17 +313,32 @@ class OptimizedHealthVectorStore:
         
         Args:
             index_path: Path to save FAISS index
-            metadata_path: Path to save metadata
+            metadata_path: Path to save metadata; a ".arrow" path writes a columnar
+                Arrow IPC file that load_vector_store can memory-map
         """
         if self.faiss_index is None:
             raise ValueError("No FAISS index to save")
         
         logger.info(f"Saving FAISS index to {index_path}")
         faiss.write_index(self.faiss_index, index_path)
+        if self.embedder is not None:
+            save_encoder_info(index_path, self.model_name, self.embedder.encoder_precision)
         
         logger.info(f"Saving metadata to {metadata_path}")
-        with open(metadata_path, 'wb') as f:
-            pickle.dump(self.metadata, f)
+        if metadata_path.endswith(".arrow"):
+            if isinstance(self.metadata, pa.Table):
+                table = self.metadata
+            else:
+                # One column per key seen in any chunk (from_pylist only uses the first row's keys)
+                keys = dict.fromkeys(key for metadata in self.metadata for key in metadata)
+                table = pa.table({key: [metadata.get(key) for metadata in self.metadata] for key in keys})
+            with pa.OSFile(metadata_path, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        else:
+            metadata = self.metadata.to_pylist() if isinstance(self.metadata, pa.Table) else self.metadata
+            with open(metadata_path, 'wb') as f:
+                pickle.dump(metadata, f)
         
         logger.info("Vector store saved successfully")
     
@@ -203,16 +347,35 @@ class OptimizedHealthVectorStore:
         """
         Load the vector store from disk.
         
+        The index's vector storage and Arrow metadata are memory-mapped, so pages
+        are read from the OS page cache on access instead of being copied into
+        RAM up front.
+        
         Args:
             index_path: Path to FAISS index
-            metadata_path: Path to metadata
+            metadata_path: Path to metadata (.pkl or .arrow)
         """
         logger.info(f"Loading FAISS index from {index_path}")
-        self.faiss_index = faiss.read_index(index_path)
+        try:
+            # Maps the flat code storage of Flat / SQ / HNSW indexes
+            self.faiss_index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_MMAP_IFC)
+        except RuntimeError:
+            # IVF inverted lists can only be mapped through the on-disk lists hook
+            self.faiss_index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+        
+        # Queries must be encoded by the model that embedded the index
+        configure_cpu_threads()
+        self.embedder = load_index_encoder(index_path, self.model_name)
+        self._cached_query_embedding.cache_clear()
+        self.embedding_dim = self.embedder.get_sentence_embedding_dimension()
         
         logger.info(f"Loading metadata from {metadata_path}")
-        with open(metadata_path, 'rb') as f:
-            self.metadata = pickle.load(f)
+        if metadata_path.endswith(".arrow"):
+            # Zero-copy: the table's buffers point into the mapped file
+            self.metadata = pa.ipc.open_file(pa.memory_map(metadata_path, 'r')).read_all()
+        else:
+            with open(metadata_path, 'rb') as f:
+                self.metadata = pickle.load(f)
         
         logger.info(f"Loaded vector store with {self.faiss_index.ntotal} vectors")
     
@@ -229,26 +392,27 @@ class OptimizedHealthVectorStore:
         }
 
 
-def create_optimized_vector_store(chunked_docs_path: str = "chunked_documents.pkl",
+def create_optimized_vector_store(chunked_docs_path: str = "chunked_documents.parquet",
                                 model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
                                 batch_size: int = 128,
-                                index_type: str = "flat") -> OptimizedHealthVectorStore:
+                                index_type: str = "auto",
+                                embeddings_path: Optional[str] = None) -> OptimizedHealthVectorStore:
     """
     Create an optimized vector store from chunked documents.
     
     Args:
-        chunked_docs_path: Path to chunked documents pickle file
+        chunked_docs_path: Path to chunked documents file (.parquet or .pkl)
         model_name: Sentence transformer model name
         batch_size: Batch size for embedding generation (optimized for CPU)
         index_type: Type of FAISS index
+        embeddings_path: Optional np.memmap file to build embeddings in instead of RAM
         
     Returns:
         OptimizedHealthVectorStore instance
     """
     # Load chunked documents
     logger.info(f"Loading chunked documents from {chunked_docs_path}")
-    with open(chunked_docs_path, 'rb') as f:
-        chunked_docs = pickle.load(f)
+    chunked_docs = load_chunked_documents(chunked_docs_path)
     
     logger.info(f"Loaded {len(chunked_docs)} chunked documents")
     
@@ -258,11 +422,15 @@ def create_optimized_vector_store(chunked_docs_path: str = "chunked_documents.pk
     # Generate embeddings
     embeddings = vector_store.generate_embeddings_optimized(
         chunked_docs, 
-        batch_size=batch_size
+        batch_size=batch_size,
+        embeddings_path=embeddings_path
     )
     
-    # Store metadata
-    vector_store.metadata = [doc.metadata for doc in chunked_docs]
+    # Store metadata, labelled once here rather than on every prompt
+    vector_store.metadata = [
+        {**doc.metadata, 'content_type': source_content_type(doc.metadata.get('source', 'Unknown'))}
+        for doc in chunked_docs
+    ]
     
     # Create FAISS index
     vector_store.create_faiss_index(embeddings, index_type=index_type)
@@ -316,26 +484,28 @@ def test_vector_search(vector_store: OptimizedHealthVectorStore,
     print("OPTIMIZED VECTOR SEARCH TEST RESULTS")
     print(f"{'='*80}")
     
-    for query in test_queries:
+    # All queries go through one encode call and one FAISS search
+    try:
+        start_time = time.time()
+        batch_results = vector_store.search_batch(test_queries, k=3)
+        search_time = time.time() - start_time
+    except Exception as e:
+        print(f"Error searching test queries: {str(e)}")
+        return
+    
+    print(f"Search time: {search_time:.4f} seconds for {len(test_queries)} queries "
+          f"({search_time / len(test_queries):.4f} s/query)")
+    
+    for query, results in zip(test_queries, batch_results):
         print(f"\nQuery: '{query}'")
         print("-" * 50)
         
-        try:
-            start_time = time.time()
-            results = vector_store.search(query, k=3)
-            search_time = time.time() - start_time
-            
-            print(f"Search time: {search_time:.4f} seconds")
-            
-            for i, (score, metadata) in enumerate(results, 1):
-                print(f"Result {i} (Score: {score:.4f}):")
-                print(f"  Source: {metadata.get('source', 'Unknown')}")
-                print(f"  Chunk: {metadata.get('chunk_index', 'N/A')}/{metadata.get('total_chunks', 'N/A')}")
-                print(f"  Size: {metadata.get('chunk_size', 'N/A')} chars")
-                print()
-                
-        except Exception as e:
-            print(f"Error searching for '{query}': {str(e)}")
+        for i, (score, metadata) in enumerate(results, 1):
+            print(f"Result {i} (Score: {score:.4f}):")
+            print(f"  Source: {metadata.get('source', 'Unknown')}")
+            print(f"  Chunk: {metadata.get('chunk_index', 'N/A')}/{metadata.get('total_chunks', 'N/A')}")
+            print(f"  Size: {metadata.get('chunk_size', 'N/A')} chars")
+            print()
 
 
 def main():
@@ -343,12 +513,12 @@ def main():
     
     # Configuration optimized for i5 CPU
     config = {
-        "chunked_docs_path": "chunked_documents.pkl",
+        "chunked_docs_path": "chunked_documents.parquet",
         "model_name": "sentence-transformers/all-MiniLM-L6-v2",  # Fast and efficient model
         "batch_size": 128,  # Optimized for CPU
-        "index_type": "flat",  # Use "ivf" for very large datasets
+        "index_type": "auto",  # "flat", "ivf", "ivfpq" or "hnsw"; auto picks hnsw above HNSW_MIN_VECTORS
         "index_path": "vector_index.idx",
-        "metadata_path": "vector_metadata.pkl"
+        "metadata_path": "vector_metadata.pkl"  # ".arrow" for a memory-mappable columnar file
     }
     
     logger.info("Starting optimized vector store creation...")
@@ -356,10 +526,9 @@ def main():
     
     # Estimate processing time
     try:
-        with open(config["chunked_docs_path"], 'rb') as f:
-            chunked_docs = pickle.load(f)
+        num_chunks = count_chunks(config["chunked_docs_path"])
         
-        time_estimate = estimate_processing_time(len(chunked_docs), config["batch_size"])
+        time_estimate = estimate_processing_time(num_chunks, config["batch_size"])
         print(f"\nTime Estimation:")
         print(f"Total chunks: {time_estimate['total_chunks']:,}")
         print(f"Estimated time: {time_estimate['estimated_minutes']:.1f} minutes ({time_estimate['estimated_hours']:.2f} hours)")
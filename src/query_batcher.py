@@ -0,0 +1,125 @@
+"""
+Query Embedding Batcher for Health Chatbot
+
+Collects query texts submitted by concurrent requests over a short window and
+encodes them with a single SentenceTransformer call (and, optionally, searches
+them with a single FAISS call), instead of running the model and the index at
+batch size 1 once per request.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+import logging
+
+import faiss
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class QueryBatcher:
+    """
+    Micro-batches query encoding across request threads.
+    """
+
+    def __init__(self, model: SentenceTransformer, max_batch: int = 16, max_wait: float = 0.008,
+                 index: Optional[faiss.Index] = None, k: int = 5):
+        """
+        Initialize the batcher and start its worker thread.
+
+        Args:
+            model: Sentence transformer used to embed queries
+            max_batch: Maximum number of queries encoded in one call
+            max_wait: Seconds to wait for more queries after the first one arrives
+            index: FAISS index to search each batch against, if any
+            k: Number of neighbours to retrieve per query when index is set
+        """
+        self.model = model
+        self.index = index
+        self.k = k
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+
+        self.worker = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self.worker.start()
+
+    def encode(self, text: str) -> np.ndarray:
+        """
+        Embed one query, blocking until its batch has been encoded.
+
+        Args:
+            text: Query text
+
+        Returns:
+            Normalized embedding of shape (1, dim)
+        """
+        return self._submit(text)[0]
+
+    def encode_and_search(self, text: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Embed one query and search it against the index, batched with concurrent queries.
+
+        Args:
+            text: Query text
+
+        Returns:
+            Tuple of (embedding, scores, ids), each with a leading dimension of 1
+        """
+        if self.index is None:
+            raise ValueError("QueryBatcher was created without an index")
+        return self._submit(text)
+
+    def _submit(self, text: str) -> Tuple[np.ndarray, Optional[np.ndarray], Optional[np.ndarray]]:
+        """Queue a query for the worker and wait for its row of the batch results."""
+        future = Future()
+        self.requests.put((text, future))
+        return future.result()
+
+    def _collect_batch(self) -> List[Tuple[str, Future]]:
+        """Block for the first query, then gather more until the batch is full or the window closes."""
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """Worker loop: encode (and search) each collected batch and hand every caller its row."""
+        while True:
+            batch = self._collect_batch()
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = self.model.encode(
+                    texts,
+                    batch_size=self.max_batch,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True,
+                    show_progress_bar=False
+                )
+                embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+                if self.index is not None:
+                    scores, ids = self.index.search(embeddings, self.k)
+            except Exception as e:
+                logger.error(f"Failed to process batch of {len(texts)} queries: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for i, (_, future) in enumerate(batch):
+                if self.index is None:
+                    future.set_result((embeddings[i:i + 1], None, None))
+                else:
+                    future.set_result((embeddings[i:i + 1], scores[i:i + 1], ids[i:i + 1]))
@@ -9,10 +9,14 @@ This module implements a complete RAG system that combines:
 
 import os
 import pickle
+import contextvars
+from functools import lru_cache
 import faiss
 import numpy as np
-from typing import List, Dict, Any, Optional, Tuple
-from sentence_transformers import SentenceTransformer
+import pyarrow as pa
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+from embedding_models import configure_cpu_threads, load_index_encoder, physical_cpu_count
+from response_cache import ResponseCache
 import logging
 from datetime import datetime
 import json
@@ -25,10 +29,56 @@ except ImportError:
     GROQ_AVAILABLE = False
     print("Warning: Groq not available. Install with: pip install groq")
 
+# Compressed (.zst) FAISS indexes
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Exact (flat) indexes larger than this are served through an HNSW graph instead
+HNSW_MIN_VECTORS = 50000
+HNSW_EF_SEARCH = 64
+
+# Per-request Groq API key override (e.g. a user-supplied key). Unlike
+# os.environ, a ContextVar is local to the current thread or task.
+groq_api_key_var = contextvars.ContextVar('groq_api_key', default=None)
+
+
+@lru_cache(maxsize=32)
+def _groq_client_for_key(api_key: str) -> "Groq":
+    """Groq client for an override key, reused so its connection pool survives across requests."""
+    return Groq(api_key=api_key)
+
+
+@lru_cache(maxsize=4096)
+def source_content_type(source: str) -> str:
+    """
+    Label shown in prompts for the collection a source file belongs to.
+    
+    Vector stores store this in each chunk's metadata as 'content_type' when they
+    are built; it is only computed here for metadata that predates that field.
+    
+    Args:
+        source: Source file path from chunk metadata
+        
+    Returns:
+        Human-readable content type
+    """
+    if 'ai-medical-chatbot.csv' in source:
+        return "Medical Q&A Database"
+    elif 'medquad.csv' in source:
+        return "Medical Knowledge Base"
+    elif 'NIH' in source:
+        return "NIH Health Information"
+    elif 'who' in source:
+        return "WHO Health Guidelines"
+    return "Health Data"
+
 
 class HealthRAGSystem:
     """
@@ -40,16 +90,19 @@ class HealthRAGSystem:
                  index_path: str = "vector_index.idx",
                  metadata_path: str = "vector_metadata.pkl",
                  groq_api_key: Optional[str] = None,
-                 groq_model: str = "llama-3.1-8b-instant"):
+                 groq_model: str = "llama-3.1-8b-instant",
+                 response_cache_path: Optional[str] = None):
         """
         Initialize the RAG system.
         
         Args:
             model_name: Sentence transformer model name
             index_path: Path to FAISS index
-            metadata_path: Path to metadata file
+            metadata_path: Path to metadata file (.pkl or .arrow)
             groq_api_key: Groq API key (if None, will try to get from environment)
             groq_model: Groq model name
+            response_cache_path: SQLite file caching responses to repeated queries
+                (None disables the cache)
         """
         self.model_name = model_name
         self.index_path = index_path
@@ -61,6 +114,10 @@ class HealthRAGSystem:
         self.faiss_index = None
         self.metadata = []
         self.groq_client = None
+        self.response_cache = ResponseCache(response_cache_path) if response_cache_path else None
+        
+        # Query text -> embedding bytes, so repeated questions skip the encoder
+        self._cached_query_embedding = lru_cache(maxsize=1024)(self._encode_query)
         
         # Force CPU usage for embedding model
         os.environ["CUDA_VISIBLE_DEVICES"] = ""
@@ -84,39 +141,124 @@ class HealthRAGSystem:
             logger.error(f"Failed to initialize Groq client: {str(e)}")
             raise
     
+    def _get_groq_client(self) -> "Groq":
+        """Groq client for the current request: the override key's client if set, else the default."""
+        api_key = groq_api_key_var.get()
+        if not api_key:
+            return self.groq_client
+        return _groq_client_for_key(api_key)
+    
     def load_search_system(self):
         """Load the search system components."""
         logger.info("Loading RAG search system...")
         
-        # Load embedding model
+        # Optimize for CPU (before the first forward pass)
+        configure_cpu_threads()
+        
+        # Load the embedding model the index was built with
         logger.info(f"Loading embedding model: {self.model_name}")
-        self.embedder = SentenceTransformer(self.model_name, device='cpu')
+        self.embedder = load_index_encoder(self.index_path, self.model_name)
+        self._cached_query_embedding.cache_clear()
         
-        # Optimize for CPU
-        import torch
-        torch.set_num_threads(4)
+        # FAISS otherwise inherits the OpenMP default, often 1 thread in containers
+        faiss.omp_set_num_threads(int(os.environ.get("FAISS_NUM_THREADS") or physical_cpu_count()))
         
         # Load FAISS index
         logger.info(f"Loading FAISS index from {self.index_path}")
-        self.faiss_index = faiss.read_index(self.index_path)
+        self.faiss_index = self._read_index(self.index_path)
+        if self.faiss_index.ntotal > HNSW_MIN_VECTORS and isinstance(self.faiss_index, faiss.IndexFlat):
+            self.faiss_index = self._load_or_build_hnsw(self.faiss_index)
         
         # Load metadata
         logger.info(f"Loading metadata from {self.metadata_path}")
-        with open(self.metadata_path, 'rb') as f:
-            self.metadata = pickle.load(f)
+        if self.metadata_path.endswith(".arrow"):
+            # Columnar and memory-mapped: rows are only decoded when retrieved
+            self.metadata = pa.ipc.open_file(pa.memory_map(self.metadata_path, 'r')).read_all()
+        else:
+            with open(self.metadata_path, 'rb') as f:
+                self.metadata = pickle.load(f)
         
         logger.info(f"RAG system loaded successfully!")
         logger.info(f"Index vectors: {self.faiss_index.ntotal:,}")
         logger.info(f"Metadata entries: {len(self.metadata):,}")
         logger.info(f"Groq model: {self.groq_model}")
     
-    def search_relevant_documents(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _read_index(index_path: str) -> faiss.Index:
+        """
+        Read a FAISS index, decompressing it while streaming when the path ends in ".zst".
+        
+        Uncompressed indexes are memory-mapped, so their vectors are paged in on
+        access instead of being copied into RAM up front.
+        """
+        if not index_path.endswith(".zst"):
+            try:
+                # Maps the flat code storage of Flat / SQ / HNSW indexes
+                index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_MMAP_IFC)
+            except RuntimeError:
+                # IVF inverted lists can only be mapped through the on-disk lists hook
+                index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+            return index
+        
+        if not ZSTD_AVAILABLE:
+            raise ImportError("zstandard is required to read a .zst index. Install with: pip install zstandard")
+        with open(index_path, 'rb') as f:
+            with zstandard.ZstdDecompressor().stream_reader(f) as compressed:
+                reader = faiss.PyCallbackIOReader(compressed.read)
+                index = faiss.read_index(reader)
+                del reader
+        return index
+    
+    def _load_or_build_hnsw(self, flat_index: faiss.IndexFlat) -> faiss.Index:
+        """
+        Get an HNSW32 copy of a large flat index, building and saving it next to the index on first use.
+        
+        Args:
+            flat_index: Loaded exact index
+            
+        Returns:
+            HNSW index with the same vectors, ids and metric
+        """
+        hnsw_path = f"{self.index_path}.hnsw32"
+        if os.path.exists(hnsw_path) and os.path.getmtime(hnsw_path) >= os.path.getmtime(self.index_path):
+            logger.info(f"Loading HNSW index from {hnsw_path}")
+            hnsw_index = self._read_index(hnsw_path)
+        else:
+            logger.info(f"Building HNSW index over {flat_index.ntotal:,} vectors (one-time)...")
+            hnsw_index = faiss.index_factory(flat_index.d, "HNSW32,Flat", flat_index.metric_type)
+            hnsw_index.add(flat_index.reconstruct_n(0, flat_index.ntotal))
+            faiss.write_index(hnsw_index, hnsw_path)
+            logger.info(f"Saved HNSW index to {hnsw_path}")
+        
+        hnsw_index.hnsw.efSearch = HNSW_EF_SEARCH
+        return hnsw_index
+    
+    def _encode_query(self, text: str) -> bytes:
+        """Encode one normalized query; bytes keep the cached value immutable."""
+        embedding = self.embedder.encode([text], convert_to_numpy=True, normalize_embeddings=True)
+        return np.ascontiguousarray(embedding, dtype=np.float32).tobytes()
+    
+    def embed_query(self, query: str) -> np.ndarray:
+        """
+        Get the normalized embedding of a query, reusing it for repeated queries.
+        
+        Args:
+            query: Query string (matched case- and surrounding-whitespace-insensitively)
+            
+        Returns:
+            Read-only float32 array of shape (1, dim)
+        """
+        return np.frombuffer(self._cached_query_embedding(query.strip().lower()), dtype=np.float32).reshape(1, -1)
+    
+    def search_relevant_documents(self, query: str, k: int = 5,
+                                  query_embedding: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
         """
         Search for relevant documents using vector similarity.
         
         Args:
             query: Search query
             k: Number of documents to retrieve
+            query_embedding: Precomputed normalized embedding of query, shape (1, dim)
             
         Returns:
             List of relevant documents with metadata
@@ -125,22 +267,61 @@ class HealthRAGSystem:
             raise ValueError("Search system not loaded. Call load_search_system() first.")
         
         # Generate query embedding
-        query_embedding = self.embedder.encode([query], convert_to_numpy=True)
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
         
         # Search in FAISS index
-        scores, indices = self.faiss_index.search(query_embedding.astype('float32'), k)
-        
-        # Format results
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx < len(self.metadata):
-                results.append({
-                    'score': float(score),
-                    'metadata': self.metadata[idx],
-                    'index': int(idx)
-                })
-        
-        return results
+        scores, indices = self.faiss_index.search(np.ascontiguousarray(query_embedding, dtype=np.float32), k)
+        
+        return self.format_search_results(scores, indices)
+    
+    def search_relevant_documents_batch(self, queries: List[str], k: int = 5) -> List[List[Dict[str, Any]]]:
+        """
+        Search for several queries with one encode call and one FAISS search.
+        
+        Args:
+            queries: User queries
+            k: Number of documents to retrieve per query
+            
+        Returns:
+            One list of relevant documents with metadata per query, in query order
+        """
+        if self.faiss_index is None:
+            raise ValueError("Search system not loaded. Call load_search_system() first.")
+        
+        query_embeddings = self.embedder.encode(
+            queries, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False
+        )
+        scores, indices = self.faiss_index.search(np.ascontiguousarray(query_embeddings, dtype=np.float32), k)
+        
+        return [self.format_search_results(scores[i:i + 1], indices[i:i + 1]) for i in range(len(queries))]
+    
+    def format_search_results(self, scores: np.ndarray, indices: np.ndarray) -> List[Dict[str, Any]]:
+        """
+        Turn one row of FAISS search output into result dictionaries.
+        
+        Args:
+            scores: Scores of shape (1, k)
+            indices: Vector ids of shape (1, k)
+            
+        Returns:
+            List of relevant documents with metadata
+        """
+        # -1 ids pad rows with fewer than k hits
+        valid = (indices[0] >= 0) & (indices[0] < len(self.metadata))
+        hit_indices = indices[0][valid].tolist()
+        
+        return [
+            {'score': score, 'metadata': row, 'index': idx}
+            for score, idx, row in zip(scores[0][valid].tolist(), hit_indices, self._metadata_rows(hit_indices))
+        ]
+    
+    def _metadata_rows(self, indices: List[int]) -> List[Dict]:
+        """Metadata of several vectors, from either a list of dicts or an Arrow table."""
+        if isinstance(self.metadata, pa.Table):
+            rows = self.metadata.take(pa.array(indices, type=pa.int64())).to_pylist()
+            return [{key: value for key, value in row.items() if value is not None} for row in rows]
+        return [self.metadata[idx] for idx in indices]
     
     def create_health_prompt(self, query: str, relevant_docs: List[Dict[str, Any]]) -> str:
         """
@@ -168,18 +349,7 @@ IMPORTANT MEDICAL DISCLAIMER:
         for i, doc in enumerate(relevant_docs, 1):
             metadata = doc['metadata']
             source = metadata.get('source', 'Unknown')
-            
-            # Determine content type
-            if 'ai-medical-chatbot.csv' in source:
-                content_type = "Medical Q&A Database"
-            elif 'medquad.csv' in source:
-                content_type = "Medical Knowledge Base"
-            elif 'NIH' in source:
-                content_type = "NIH Health Information"
-            elif 'who' in source:
-                content_type = "WHO Health Guidelines"
-            else:
-                content_type = "Health Data"
+            content_type = metadata.get('content_type') or source_content_type(source)
             
             context_parts.append(f"[Source {i}: {content_type}]")
             context_parts.append(f"Relevance Score: {doc['score']:.3f}")
@@ -210,13 +380,17 @@ RESPONSE:"""
         
         return prompt
     
-    def generate_response(self, query: str, max_retries: int = 3) -> Dict[str, Any]:
+    def generate_response(self, query: str, max_retries: int = 3,
+                          query_embedding: Optional[np.ndarray] = None,
+                          relevant_docs: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
         """
         Generate a response using RAG system.
         
         Args:
             query: User's health question
             max_retries: Maximum number of retry attempts
+            query_embedding: Precomputed normalized embedding of query, if available
+            relevant_docs: Precomputed retrieval results; skips the search when given
             
         Returns:
             Dictionary containing response and metadata
@@ -226,7 +400,21 @@ RESPONSE:"""
         
         try:
             # Search for relevant documents
-            relevant_docs = self.search_relevant_documents(query, k=5)
+            if relevant_docs is None:
+                relevant_docs = self.search_relevant_documents(query, k=5, query_embedding=query_embedding)
+            
+            # Same question answered from the same documents: reuse the stored answer
+            cache_key = None
+            if self.response_cache is not None:
+                cache_key = ResponseCache.make_key(query, [doc['index'] for doc in relevant_docs], self.groq_model)
+                cached_text = self.response_cache.get(cache_key)
+                if cached_text is not None:
+                    return {
+                        'response': cached_text,
+                        'metadata': self._response_metadata(query, relevant_docs, attempt=0, cached=True,
+                                                            response_length=len(cached_text)),
+                        'relevant_docs': relevant_docs
+                    }
             
             # Create prompt
             prompt = self.create_health_prompt(query, relevant_docs)
@@ -234,7 +422,7 @@ RESPONSE:"""
             # Generate response with Groq
             for attempt in range(max_retries):
                 try:
-                    response = self.groq_client.chat.completions.create(
+                    response = self._get_groq_client().chat.completions.create(
                         model=self.groq_model,
                         messages=[
                             {
@@ -249,21 +437,13 @@ RESPONSE:"""
                     
                     # Extract response content
                     response_text = response.choices[0].message.content
-                    
-                    # Calculate response metadata
-                    response_metadata = {
-                        'query': query,
-                        'timestamp': datetime.now().isoformat(),
-                        'model_used': self.groq_model,
-                        'relevant_docs_count': len(relevant_docs),
-                        'top_doc_score': relevant_docs[0]['score'] if relevant_docs else None,
-                        'attempt': attempt + 1,
-                        'response_length': len(response_text)
-                    }
+                    if cache_key is not None:
+                        self.response_cache.set(cache_key, response_text)
                     
                     return {
                         'response': response_text,
-                        'metadata': response_metadata,
+                        'metadata': self._response_metadata(query, relevant_docs, attempt=attempt + 1,
+                                                            response_length=len(response_text)),
                         'relevant_docs': relevant_docs
                     }
                     
@@ -286,6 +466,126 @@ RESPONSE:"""
                 'relevant_docs': []
             }
     
+    def generate_response_stream(self, query: str, max_retries: int = 3,
+                                 query_embedding: Optional[np.ndarray] = None,
+                                 relevant_docs: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        Generate a response using RAG system, streaming tokens as Groq produces them.
+        
+        Retrieval happens up front so the sources are available immediately;
+        retries only cover opening the stream, not failures mid-stream.
+        
+        Args:
+            query: User's health question
+            max_retries: Maximum number of retry attempts
+            query_embedding: Precomputed normalized embedding of query, if available
+            relevant_docs: Precomputed retrieval results; skips the search when given
+            
+        Returns:
+            Dictionary like generate_response, except 'response' is an iterator
+            of text deltas
+        """
+        if self.groq_client is None:
+            raise ValueError("Groq client not initialized")
+        
+        try:
+            # Search for relevant documents
+            if relevant_docs is None:
+                relevant_docs = self.search_relevant_documents(query, k=5, query_embedding=query_embedding)
+            
+            # Same question answered from the same documents: replay the stored answer
+            cache_key = None
+            if self.response_cache is not None:
+                cache_key = ResponseCache.make_key(query, [doc['index'] for doc in relevant_docs], self.groq_model)
+                cached_text = self.response_cache.get(cache_key)
+                if cached_text is not None:
+                    return {
+                        'response': iter([cached_text]),
+                        'metadata': self._response_metadata(query, relevant_docs, attempt=0, cached=True),
+                        'relevant_docs': relevant_docs
+                    }
+            
+            # Create prompt
+            prompt = self.create_health_prompt(query, relevant_docs)
+            
+            # Open the Groq stream
+            for attempt in range(max_retries):
+                try:
+                    completion = self._get_groq_client().chat.completions.create(
+                        model=self.groq_model,
+                        messages=[
+                            {
+                                "role": "user",
+                                "content": prompt
+                            }
+                        ],
+                        temperature=0.3,  # Lower temperature for more consistent medical responses
+                        max_tokens=1000,
+                        top_p=0.9,
+                        stream=True
+                    )
+                    break
+                    
+                except Exception as e:
+                    logger.warning(f"Attempt {attempt + 1} failed: {str(e)}")
+                    if attempt == max_retries - 1:
+                        raise
+                    continue
+            
+        except Exception as e:
+            logger.error(f"Failed to generate response: {str(e)}")
+            return {
+                'response': iter(["I apologize, but I'm experiencing technical difficulties. Please try again or consult a healthcare professional for immediate medical concerns."]),
+                'metadata': {
+                    'query': query,
+                    'timestamp': datetime.now().isoformat(),
+                    'error': str(e),
+                    'model_used': self.groq_model
+                },
+                'relevant_docs': []
+            }
+        
+        tokens = self._iter_stream_tokens(completion)
+        if cache_key is not None:
+            tokens = self._cache_stream(tokens, cache_key)
+        
+        return {
+            'response': tokens,
+            'metadata': self._response_metadata(query, relevant_docs, attempt=attempt + 1),
+            'relevant_docs': relevant_docs
+        }
+    
+    def _response_metadata(self, query: str, relevant_docs: List[Dict[str, Any]], attempt: int,
+                           **extra) -> Dict[str, Any]:
+        """Metadata reported with a generated (or cached, attempt 0) response."""
+        return {
+            'query': query,
+            'timestamp': datetime.now().isoformat(),
+            'model_used': self.groq_model,
+            'relevant_docs_count': len(relevant_docs),
+            'top_doc_score': relevant_docs[0]['score'] if relevant_docs else None,
+            'attempt': attempt,
+            **extra
+        }
+    
+    def _cache_stream(self, tokens: Iterator[str], cache_key: bytes) -> Iterator[str]:
+        """Pass streamed deltas through, caching the full text once the stream completes."""
+        parts = []
+        for delta in tokens:
+            parts.append(delta)
+            yield delta
+        self.response_cache.set(cache_key, ''.join(parts))
+    
+    @staticmethod
+    def _iter_stream_tokens(completion) -> Iterator[str]:
+        """Yield the non-empty content deltas of a streamed chat completion."""
+        for chunk in completion:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    
     def chat(self, message: str) -> str:
         """
         Simple chat interface that returns just the response text.
@@ -299,17 +599,25 @@ RESPONSE:"""
         result = self.generate_response(message)
         return result['response']
     
-    def get_conversation_context(self, query: str) -> Dict[str, Any]:
+    def get_conversation_context(self, query: str, stream: bool = False,
+                                 query_embedding: Optional[np.ndarray] = None,
+                                 relevant_docs: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
         """
         Get detailed conversation context including sources and metadata.
         
         Args:
             query: User's health question
+            stream: If True, 'response' is an iterator of tokens streamed from Groq
+            query_embedding: Precomputed normalized embedding of query, if available
+            relevant_docs: Precomputed retrieval results; skips the search when given
             
         Returns:
             Detailed response with sources and metadata
         """
-        return self.generate_response(query)
+        if stream:
+            return self.generate_response_stream(query, query_embedding=query_embedding,
+                                                 relevant_docs=relevant_docs)
+        return self.generate_response(query, query_embedding=query_embedding, relevant_docs=relevant_docs)
 
 
 def main():
@@ -320,7 +628,8 @@ def main():
         "model_name": "sentence-transformers/all-MiniLM-L6-v2",
         "index_path": "vector_index.idx",
         "metadata_path": "vector_metadata.pkl",
-        "groq_model": "llama-3.1-8b-instant"
+        "groq_model": "llama-3.1-8b-instant",
+        "response_cache_path": "rag_response_cache.sqlite"
     }
     
     # Check for Groq API key
@@ -10,17 +10,31 @@ import re
 import json
 import pickle
 import hashlib
+import mmap
 from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
 import logging
 from dataclasses import dataclass
-from sentence_transformers import SentenceTransformer
 import numpy as np
+from embedding_models import load_fp32_model, load_int8_onnx_model
+
+# Fast non-cryptographic content fingerprints
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Phrase matching replaces every character that is neither a word character nor
+# whitespace with a space. For ASCII text the same mapping runs as a C-level
+# str.translate table; the regex is only needed for non-ASCII text.
+_NON_WORD_RE = re.compile(r'[^\w\s]')
+_ASCII_NON_WORD_TABLE = {c: ' ' for c in range(128) if _NON_WORD_RE.match(chr(c))}
+
 @dataclass
 class SourceVerification:
     """Data class for source verification results."""
@@ -51,18 +65,26 @@ class RAGVerificationSystem:
     
     def __init__(self, 
                  metadata_path: str = "vector_metadata.pkl",
-                 embedder_model: str = "sentence-transformers/all-MiniLM-L6-v2"):
+                 embedder_model: str = "sentence-transformers/all-MiniLM-L6-v2",
+                 low_precision: bool = True):
         """
         Initialize the verification system.
         
         Args:
             metadata_path: Path to the metadata file
             embedder_model: Sentence transformer model for semantic similarity
+            low_precision: Encode with the int8 ONNX model. Similarities then differ
+                slightly from the FP32 model's, which the thresholds were set on;
+                False loads the FP32 model instead
         """
         self.metadata_path = metadata_path
-        self.embedder = SentenceTransformer(embedder_model, device='cpu')
+        # Either model is shared with a RAG system serving an index built with it
+        self.embedder = load_int8_onnx_model(embedder_model) if low_precision else load_fp32_model(embedder_model)
         self.metadata = []
         self.source_content_cache = {}
+        self.source_ngram_cache = {}  # source path -> set of its 3-5 word phrases
+        self.source_embedding_cache: Dict[str, np.ndarray] = {}
+        self.source_hash_cache: Dict[str, str] = {}
         
         # Load metadata
         self._load_metadata()
@@ -86,6 +108,10 @@ class RAGVerificationSystem:
         """
         Get content from source file with caching.
         
+        The file is memory-mapped so its hash is computed over the raw bytes and
+        the text is decoded once, without reading the file into a bytes copy or
+        re-encoding the decoded text for hashing.
+        
         Args:
             source_path: Path to source file
             
@@ -97,9 +123,16 @@ class RAGVerificationSystem:
         
         try:
             if os.path.exists(source_path):
-                with open(source_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
+                with open(source_path, 'rb') as f:
+                    if os.fstat(f.fileno()).st_size == 0:
+                        # mmap cannot map an empty file
+                        content_hash, content = self._calculate_content_hash(b""), ""
+                    else:
+                        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                            content_hash = self._calculate_content_hash(mapped)
+                            content = str(mapped, 'utf-8')
                 self.source_content_cache[source_path] = content
+                self.source_hash_cache[source_path] = content_hash
                 return content
             else:
                 logger.warning(f"Source file not found: {source_path}")
@@ -108,66 +141,89 @@ class RAGVerificationSystem:
             logger.error(f"Error reading source file {source_path}: {str(e)}")
             return ""
     
-    def _calculate_content_hash(self, content: str) -> str:
-        """Calculate hash of content for verification."""
-        return hashlib.md5(content.encode('utf-8')).hexdigest()
+    def _calculate_content_hash(self, content) -> str:
+        """Calculate hash of content (text, or raw bytes / a memory map) for verification."""
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        # A fingerprint, not a security boundary: XXH3 runs at memory bandwidth,
+        # BLAKE2b is the stdlib fallback (both 128-bit)
+        if XXHASH_AVAILABLE:
+            return xxhash.xxh3_128(content).hexdigest()
+        return hashlib.blake2b(content, digest_size=16).hexdigest()
+    
+    def _phrase_ngrams(self, text: str) -> set:
+        """All 3-5 word phrases of text, lower-cased with punctuation removed."""
+        text = text.lower()
+        if text.isascii():
+            text = text.translate(_ASCII_NON_WORD_TABLE)
+        else:
+            text = _NON_WORD_RE.sub(' ', text)
+        words = text.split()
+        return {
+            ' '.join(words[i:i + phrase_length])
+            for phrase_length in range(3, 6)
+            for i in range(len(words) - phrase_length + 1)
+        }
     
-    def _find_exact_matches(self, response: str, source_content: str) -> List[str]:
+    def _find_exact_matches(self, response: str, source_content: str,
+                            source_path: Optional[str] = None) -> List[str]:
         """
         Find exact phrase matches between response and source.
         
+        Phrases of 3-5 words are matched by set intersection, so the cost is
+        linear in the lengths of both texts rather than their product.
+        
         Args:
             response: Generated response
             source_content: Source document content
+            source_path: Path of the source; when given, its phrases are cached
             
         Returns:
             List of exact matching phrases
         """
-        # Clean and normalize text
-        response_clean = re.sub(r'[^\w\s]', ' ', response.lower())
-        source_clean = re.sub(r'[^\w\s]', ' ', source_content.lower())
-        
-        # Find phrases of 3+ words that appear in both
-        response_words = response_clean.split()
-        source_words = source_clean.split()
-        
-        exact_matches = []
-        
-        # Check for 3-5 word phrases
-        for phrase_length in range(3, 6):
-            for i in range(len(response_words) - phrase_length + 1):
-                phrase = ' '.join(response_words[i:i + phrase_length])
-                if phrase in ' '.join(source_words):
-                    exact_matches.append(phrase)
+        if source_path is None:
+            source_ngrams = self._phrase_ngrams(source_content)
+        elif source_path in self.source_ngram_cache:
+            source_ngrams = self.source_ngram_cache[source_path]
+        else:
+            source_ngrams = self.source_ngram_cache[source_path] = self._phrase_ngrams(source_content)
         
-        return list(set(exact_matches))  # Remove duplicates
+        return list(self._phrase_ngrams(response) & source_ngrams)
     
-    def _calculate_semantic_similarity(self, response: str, source_content: str) -> float:
+    def _calculate_semantic_similarity(self, response: str, source_content: str,
+                                       source_path: Optional[str] = None) -> float:
         """
         Calculate semantic similarity between response and source.
         
         Args:
             response: Generated response
             source_content: Source document content
+            source_path: Path of the source; when given, its embedding is cached
             
         Returns:
             Semantic similarity score (0-1)
         """
         try:
-            # Encode texts
-            response_embedding = self.embedder.encode([response])
-            source_embedding = self.embedder.encode([source_content])
-            
-            # Calculate cosine similarity
-            similarity = np.dot(response_embedding[0], source_embedding[0]) / (
-                np.linalg.norm(response_embedding[0]) * np.linalg.norm(source_embedding[0])
-            )
+            # Encode texts; a source file is only encoded the first time it is verified against
+            if source_path is not None and source_path in self.source_embedding_cache:
+                response_embedding = self._encode([response])[0]
+                source_embedding = self.source_embedding_cache[source_path]
+            else:
+                response_embedding, source_embedding = self._encode([response, source_content])
+                if source_path is not None:
+                    self.source_embedding_cache[source_path] = source_embedding
             
-            return float(similarity)
+            # Embeddings are unit length, so cosine similarity is their dot product
+            return float(response_embedding @ source_embedding)
         except Exception as e:
             logger.error(f"Error calculating semantic similarity: {str(e)}")
             return 0.0
     
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts in one batched call into normalized embeddings of shape (len(texts), dim)."""
+        return self.embedder.encode(texts, batch_size=32, convert_to_numpy=True,
+                                    normalize_embeddings=True, show_progress_bar=False)
+    
     def verify_source_grounding(self, response: str, source_metadata: Dict[str, Any]) -> SourceVerification:
         """
         Verify if response is grounded in a specific source.
@@ -181,7 +237,27 @@ class RAGVerificationSystem:
         """
         source_path = source_metadata.get('source', '')
         source_content = self._get_source_content(source_path)
+        semantic_similarity = (
+            self._calculate_semantic_similarity(response, source_content, source_path) if source_content else 0.0
+        )
+        
+        return self._verify_source_from_similarity(response, source_metadata, source_content, semantic_similarity)
+    
+    def _verify_source_from_similarity(self, response: str, source_metadata: Dict[str, Any],
+                                       source_content: str, semantic_similarity: float) -> SourceVerification:
+        """
+        Score a source's grounding given its already-computed semantic similarity.
         
+        Args:
+            response: Generated response text
+            source_metadata: Metadata for the source document
+            source_content: Content of the source file ("" if unavailable)
+            semantic_similarity: Cosine similarity of response and source embeddings
+            
+        Returns:
+            SourceVerification object with verification results
+        """
+        source_path = source_metadata.get('source', '')
         if not source_content:
             return SourceVerification(
                 source_id=str(source_metadata.get('id', 'unknown')),
@@ -195,10 +271,7 @@ class RAGVerificationSystem:
             )
         
         # Find exact matches
-        exact_matches = self._find_exact_matches(response, source_content)
-        
-        # Calculate semantic similarity
-        semantic_similarity = self._calculate_semantic_similarity(response, source_content)
+        exact_matches = self._find_exact_matches(response, source_content, source_path)
         
         # Calculate verification confidence
         exact_match_score = min(len(exact_matches) * 0.2, 1.0)  # Cap at 1.0
@@ -213,7 +286,7 @@ class RAGVerificationSystem:
         return SourceVerification(
             source_id=str(source_metadata.get('id', 'unknown')),
             source_file=os.path.basename(source_path),
-            content_hash=self._calculate_content_hash(source_content),
+            content_hash=self.source_hash_cache.get(source_path) or self._calculate_content_hash(source_content),
             similarity_score=semantic_similarity,
             exact_matches=exact_matches,
             semantic_overlap=verification_confidence,
@@ -236,21 +309,49 @@ class RAGVerificationSystem:
         Returns:
             ResponseVerification object with complete verification results
         """
-        source_verifications = []
+        sources = []
+        for doc in relevant_docs:
+            source_path = doc['metadata'].get('source', '')
+            sources.append((doc['metadata'], source_path, self._get_source_content(source_path)))
+        
+        # One encode call for the response and every source not embedded yet
+        uncached = {path: content for _, path, content in sources
+                    if content and path not in self.source_embedding_cache}
+        try:
+            embeddings = self._encode([response] + list(uncached.values()))
+            response_embedding = embeddings[0]
+            self.source_embedding_cache.update(zip(uncached, embeddings[1:]))
+        except Exception as e:
+            logger.error(f"Error calculating semantic similarity: {str(e)}")
+            response_embedding = None
+        
+        # Cosine similarity of the response to every readable source in one matrix-vector product
+        similarities = np.zeros(len(sources), dtype=np.float32)
+        embedded = [i for i, (_, _, content) in enumerate(sources) if content]
+        if embedded and response_embedding is not None:
+            source_embeddings = np.stack([self.source_embedding_cache[sources[i][1]] for i in embedded])
+            similarities[embedded] = source_embeddings @ response_embedding
         
         # Verify each source
-        for doc in relevant_docs:
-            source_verification = self.verify_source_grounding(response, doc['metadata'])
-            source_verifications.append(source_verification)
+        source_verifications = [
+            self._verify_source_from_similarity(response, metadata, source_content, semantic_similarity)
+            for (metadata, _, source_content), semantic_similarity in zip(sources, similarities.tolist())
+        ]
+        
+        # Aggregate per-source results in a single pass
+        sum_confidence = sum_similarity = 0.0
+        verified_sources = total_exact_matches = 0
+        for sv in source_verifications:
+            sum_confidence += sv.verification_confidence
+            sum_similarity += sv.similarity_score
+            verified_sources += sv.is_verified
+            total_exact_matches += len(sv.exact_matches)
         
         # Calculate overall verification score
-        if source_verifications:
-            total_score = sum(sv.verification_confidence for sv in source_verifications) / len(source_verifications)
-            verified_sources = sum(1 for sv in source_verifications if sv.is_verified)
-            verification_ratio = verified_sources / len(source_verifications)
-        else:
-            total_score = 0.0
-            verification_ratio = 0.0
+        num_sources = len(source_verifications)
+        total_score = sum_confidence / num_sources if num_sources else 0.0
+        verification_ratio = verified_sources / num_sources if num_sources else 0.0
+        average_similarity = sum_similarity / num_sources if num_sources else 0.0
         
         # Determine grounding status
         is_grounded = total_score > self.GROUNDING_THRESHOLD and verification_ratio > 0.3
@@ -266,9 +367,9 @@ class RAGVerificationSystem:
         # Collect verification details
         verification_details = {
             'total_sources': len(relevant_docs),
-            'verified_sources': sum(1 for sv in source_verifications if sv.is_verified),
-            'average_similarity': np.mean([sv.similarity_score for sv in source_verifications]) if source_verifications else 0.0,
-            'total_exact_matches': sum(len(sv.exact_matches) for sv in source_verifications),
+            'verified_sources': verified_sources,
+            'average_similarity': average_similarity,
+            'total_exact_matches': total_exact_matches,
             'verification_timestamp': datetime.now().isoformat(),
             'thresholds_used': {
                 'exact_match': self.EXACT_MATCH_THRESHOLD,
@@ -0,0 +1,117 @@
+"""
+Disk-Backed Response Cache for Health Chatbot
+
+Persists generated answers in SQLite, keyed on the normalized query, the ids of
+the retrieved documents and the LLM model, so repeated questions skip the Groq
+round-trip even across restarts and between server worker processes.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Optional, Sequence
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    SQLite-backed LRU cache of response texts with a time-to-live.
+    """
+
+    def __init__(self, path: str = "rag_response_cache.sqlite", ttl: float = 7 * 86400,
+                 max_entries: int = 10000):
+        """
+        Open (or create) the cache database.
+
+        Args:
+            path: SQLite database file
+            ttl: Seconds a cached response stays valid
+            max_entries: Entries kept before the least recently used are evicted
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+        # One connection shared by request threads, serialized by the lock; WAL
+        # lets other worker processes read while one writes
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key BLOB PRIMARY KEY, response TEXT, created REAL, last_used REAL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(query: str, doc_ids: Sequence[int], model: str) -> bytes:
+        """
+        Cache key for a query answered from the given documents by the given model.
+
+        Args:
+            query: User query (compared case- and whitespace-insensitively)
+            doc_ids: Vector ids of the retrieved documents, in rank order
+            model: LLM model name
+
+        Returns:
+            16-byte digest
+        """
+        normalized = ' '.join(query.lower().split())
+        ids = ','.join(map(str, doc_ids))
+        return hashlib.blake2b(f"{normalized}\0{ids}\0{model}".encode('utf-8'), digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[str]:
+        """
+        Get a cached response, refreshing its position in the LRU order.
+
+        Args:
+            key: Key from make_key
+
+        Returns:
+            Response text, or None if missing or expired
+        """
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response FROM responses WHERE key = ? AND created > ?", (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            with self.conn:
+                self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: bytes, response: str):
+        """
+        Cache a response, evicting the least recently used tenth once the cache is full.
+
+        Args:
+            key: Key from make_key
+            response: Response text
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            self.entries += 1
+            if self.entries > self.max_entries:
+                # Expired rows go first, then the least recently used down to 90% capacity
+                self.conn.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,))
+                count = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                excess = count - self.max_entries * 9 // 10
+                if excess > 0:
+                    self.conn.execute(
+                        "DELETE FROM responses WHERE key IN "
+                        "(SELECT key FROM responses ORDER BY last_used LIMIT ?)", (excess,)
+                    )
+                    count -= excess
+                self.entries = count
@@ -0,0 +1,101 @@
+"""
+Semantic Response Cache for Health Chatbot
+
+Caches generated RAG responses keyed on the embedding of the user's query, so
+paraphrases of a question that was already answered skip retrieval and the
+Groq round-trip entirely.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+import logging
+
+import faiss
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """
+    In-process cache of responses, looked up by cosine similarity of query embeddings.
+    """
+
+    def __init__(self, dim: int, threshold: float = 0.95, max_entries: int = 1024):
+        """
+        Initialize the semantic cache.
+
+        Args:
+            dim: Dimension of the (L2-normalized) query embeddings
+            threshold: Minimum cosine similarity for a cached response to be reused
+            max_entries: Maximum number of cached responses before LRU eviction
+        """
+        self.dim = dim
+        self.threshold = threshold
+        self.max_entries = max_entries
+
+        # Inner product on normalized vectors is cosine similarity. IndexIDMap2
+        # over a flat index supports remove_ids, which eviction needs.
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self.entries = OrderedDict()  # id -> result, least recently used first
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, embedding: np.ndarray) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached result for the closest previous query, if similar enough.
+
+        Args:
+            embedding: Normalized query embedding of shape (1, dim)
+
+        Returns:
+            Cached result dictionary, or None on a miss
+        """
+        query = np.ascontiguousarray(embedding, dtype=np.float32).reshape(1, self.dim)
+        with self.lock:
+            if self.index.ntotal:
+                scores, ids = self.index.search(query, 1)
+                entry_id = int(ids[0][0])
+                if scores[0][0] >= self.threshold and entry_id in self.entries:
+                    self.entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return self.entries[entry_id]
+            self.misses += 1
+            return None
+
+    def store(self, embedding: np.ndarray, result: Dict[str, Any]):
+        """
+        Cache a result under its query embedding, evicting the least recently used entry when full.
+
+        Args:
+            embedding: Normalized query embedding of shape (1, dim)
+            result: Result dictionary to return for similar queries
+        """
+        vector = np.ascontiguousarray(embedding, dtype=np.float32).reshape(1, self.dim)
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                evicted_id, _ = self.entries.popitem(last=False)
+                self.index.remove_ids(np.array([evicted_id], dtype=np.int64))
+
+            entry_id = self.next_id
+            self.next_id += 1
+            self.index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+            self.entries[entry_id] = result
+
+    def stats(self) -> Dict[str, Any]:
+        """Get cache statistics."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
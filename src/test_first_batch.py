@@ -15,12 +15,14 @@ import time
 import os
 from tqdm import tqdm
 
+from chunking import load_chunked_documents
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def test_first_batch(chunked_docs_path: str = "chunked_documents.pkl",
+def test_first_batch(chunked_docs_path: str = "chunked_documents.parquet",
                     batch_size: int = 50000,
                     model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
                     embedding_batch_size: int = 128):
@@ -39,8 +41,7 @@ def test_first_batch(chunked_docs_path: str = "chunked_documents.pkl",
     
     # Load chunked documents
     logger.info(f"Loading chunked documents from {chunked_docs_path}")
-    with open(chunked_docs_path, 'rb') as f:
-        chunked_docs = pickle.load(f)
+    chunked_docs = load_chunked_documents(chunked_docs_path)
     
     total_chunks = len(chunked_docs)
     logger.info(f"Total chunks available: {total_chunks:,}")
@@ -85,7 +86,7 @@ def test_first_batch(chunked_docs_path: str = "chunked_documents.pkl",
     # Create FAISS index
     logger.info("Creating FAISS index...")
     index = faiss.IndexFlatL2(embedding_dim)
-    index.add(embeddings.astype('float32'))
+    index.add(np.ascontiguousarray(embeddings, dtype=np.float32))
     
     logger.info(f"FAISS index created with {index.ntotal} vectors")
     
@@ -112,7 +113,7 @@ def test_first_batch(chunked_docs_path: str = "chunked_documents.pkl",
         
         # Search
         start_search = time.time()
-        scores, indices = index.search(query_embedding.astype('float32'), 3)
+        scores, indices = index.search(np.ascontiguousarray(query_embedding, dtype=np.float32), 3)
         search_time = time.time() - start_search
         
         print(f"Search time: {search_time:.4f} seconds")
@@ -180,7 +181,7 @@ def main():
     
     # Configuration
     config = {
-        "chunked_docs_path": "chunked_documents.pkl",
+        "chunked_docs_path": "chunked_documents.parquet",
         "batch_size": 50000,  # First 50K chunks
         "model_name": "sentence-transformers/all-MiniLM-L6-v2",
         "embedding_batch_size": 128
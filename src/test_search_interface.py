@@ -91,13 +91,13 @@ class HealthSearchInterface:
         
         # Search in FAISS index
         start_time = time.time()
-        scores, indices = self.faiss_index.search(query_embedding.astype('float32'), k)
+        scores, indices = self.faiss_index.search(np.ascontiguousarray(query_embedding, dtype=np.float32), k)
         search_time = time.time() - start_time
         
         # Format results
         results = []
         for i, (score, idx) in enumerate(zip(scores[0], indices[0]), 1):
-            if idx < len(self.metadata):
+            if 0 <= idx < len(self.metadata):
                 result = {
                     'rank': i,
                     'score': float(score),
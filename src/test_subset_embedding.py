@@ -14,12 +14,14 @@ import logging
 import time
 import os
 
+from chunking import load_chunked_documents
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def test_subset_embedding(chunked_docs_path: str = "chunked_documents.pkl",
+def test_subset_embedding(chunked_docs_path: str = "chunked_documents.parquet",
                          subset_size: int = 10000,
                          model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
                          batch_size: int = 128):
@@ -38,8 +40,7 @@ def test_subset_embedding(chunked_docs_path: str = "chunked_documents.pkl",
     
     # Load chunked documents
     logger.info(f"Loading chunked documents from {chunked_docs_path}")
-    with open(chunked_docs_path, 'rb') as f:
-        chunked_docs = pickle.load(f)
+    chunked_docs = load_chunked_documents(chunked_docs_path)
     
     logger.info(f"Total chunks available: {len(chunked_docs):,}")
     
@@ -80,7 +81,7 @@ def test_subset_embedding(chunked_docs_path: str = "chunked_documents.pkl",
     logger.info("Creating FAISS index...")
     embedding_dim = embeddings.shape[1]
     index = faiss.IndexFlatL2(embedding_dim)
-    index.add(embeddings.astype('float32'))
+    index.add(np.ascontiguousarray(embeddings, dtype=np.float32))
     
     logger.info(f"FAISS index created with {index.ntotal} vectors")
     
@@ -107,7 +108,7 @@ def test_subset_embedding(chunked_docs_path: str = "chunked_documents.pkl",
         
         # Search
         start_search = time.time()
-        scores, indices = index.search(query_embedding.astype('float32'), 3)
+        scores, indices = index.search(np.ascontiguousarray(query_embedding, dtype=np.float32), 3)
         search_time = time.time() - start_search
         
         print(f"Search time: {search_time:.4f} seconds")